@@ -1,23 +1,26 @@
-import os, random, threading, time, queue, uuid, hashlib
+import os, threading, time, uuid, hashlib, base64, asyncio, zlib, logging
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
 from contextlib import asynccontextmanager
-from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any
-import os, random, threading, time, queue, uuid, hashlib
-from contextlib import asynccontextmanager
-from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any
+from datetime import datetime, timezone
+from typing import Dict, Any
 
-from fastapi import FastAPI, Request, UploadFile, File, Form, Depends, HTTPException
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, Body, Depends, HTTPException
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import case
+from sqlalchemy import func, tuple_, type_coerce, update, String
 from dotenv import load_dotenv
-from database import SessionLocal, init_db
+from database import SessionLocal, engine, init_db
+import migrations
 from models import Settings, Image
-from utils import eframe_inky
-from utils.image_utils import save_upload, render_to_output, ensure_dirs
+from utils import eframe_inky, render_cache, events, frame_store, display_queue, play_queue, settings_cache, jobs, task_store
+from utils import log as logs
+from utils.dither import DITHER_MODES, DEFAULT_DITHER_MODE
+from utils.crop_engine import calculate_smart_crop, batch_saliency_crops, refit_crops
+from utils.image_utils import store_upload, process_upload, file_hash, ensure_dirs, thumbnail_paths, thumb_path, THUMB_SIZES, THUMB_EXTENSIONS
 
 # Load environment variables from .env file
 load_dotenv()
@@ -27,43 +30,13 @@ def is_dev_mode():
     env = os.getenv('ENVIRONMENT', '').lower()
     return env in ('development', 'dev')
 
-def calculate_smart_crop(image_width, image_height, display_resolution):
-    """
-    Calculate smart default crop that centers the image if it needs cropping.
-    Returns (crop_x, crop_y, crop_width, crop_height) as percentages.
-    """
-    if not display_resolution or ',' not in display_resolution:
-        # Fallback to full image if no valid resolution
-        return 0, 0, 100, 100
-    
-    try:
-        display_width, display_height = map(int, display_resolution.split(','))
-        display_aspect = display_width / display_height
-        image_aspect = image_width / image_height
-        
-        if abs(display_aspect - image_aspect) < 0.01:
-            # Aspect ratios are very close, use full image
-            return 0, 0, 100, 100
-        
-        if image_aspect > display_aspect:
-            # Image is wider than display - crop horizontally, center left-right
-            crop_height = 100  # Use full height
-            crop_width = (display_aspect / image_aspect) * 100
-            crop_x = (100 - crop_width) / 2  # Center horizontally
-            crop_y = 0
-        else:
-            # Image is taller than display - crop vertically, center top-bottom  
-            crop_width = 100  # Use full width
-            crop_height = (image_aspect / display_aspect) * 100
-            crop_x = 0
-            crop_y = (100 - crop_height) / 2  # Center vertically
-        
-        # Round to 2 decimal places
-        return round(crop_x, 2), round(crop_y, 2), round(crop_width, 2), round(crop_height, 2)
-        
-    except (ValueError, ZeroDivisionError):
-        # Fallback to full image on any calculation error
-        return 0, 0, 100, 100
+logs.setup(dev_mode=is_dev_mode())
+log = logs.get_logger("app")
+upload_log = logs.get_logger("upload")
+display_log = logs.get_logger("display")
+slideshow_log = logs.get_logger("slideshow")
+render_log = logs.get_logger("render")
+crops_log = logs.get_logger("crops")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -83,25 +56,59 @@ async def lifespan(app: FastAPI):
             except Exception:
                 pass
             db.add(s); db.commit()
-        ensure_dirs(s.image_root, s.thumb_root, os.path.dirname("static/current.jpg"))
+        ensure_dirs(s.image_root, s.thumb_root, os.path.dirname(frame_store.CURRENT_FRAME))
+    
+    # Upload tasks interrupted by the last shutdown resume below and chunked upload sessions
+    # stay open for the client; staged files nobody will pick up are removed
+    resumable = task_store.load()
+    clean_staging({f[1] for task_id in resumable + task_store.active((task_store.RECEIVING,))
+                   for f in task_store.payload(task_id)["files"]})
     
-    # Start background threads
-    start_display_worker()
-    start_upload_worker()
+    # Start background work; everything runs as jobs on the scheduler
+    jobs.start()
+    display_queue.start()
+    start_upload_pool()
+    for task_id in resumable:
+        upload_log.info("Resuming task %s", task_id)
+        task_store.update(task_id, status="queued", current_file=None)
+        queue_upload(task_id)
+    # Also expires upload sessions the last run left open
+    schedule_upload_watchdog()
+    # Hashes and thumbnails for images from before those features; resumes where it left off
+    jobs.submit("thumbnail", backfill_job, priority=jobs.PRIORITY_LOW)
     start_slideshow()
     
     yield
     
     # Shutdown
-    print("[SHUTDOWN] Stopping background threads...")
-    stop_display_worker()
-    stop_upload_worker()
-    SLIDESHOW_THREAD["stop"] = True
-    if SLIDESHOW_THREAD["t"] and SLIDESHOW_THREAD["t"].is_alive():
-        SLIDESHOW_THREAD["t"].join(timeout=5)
+    log.info("Stopping background jobs...")
+    stop_slideshow()
+    display_queue.close()
+    jobs.shutdown()
+    # Upload task changes the cancelled flush job didn't get to
+    task_store.flush()
+    stop_upload_pool()
 
 app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
+
+def thumb_url(filename: str, size: int, fmt: str) -> str:
+    stem = os.path.splitext(filename)[0]
+    return f"/static/thumbs/{size}/{stem}.{THUMB_EXTENSIONS[fmt]}"
+
+def thumb_srcset(image: Image, fmt: str) -> str:
+    """srcset value listing every pyramid level of an image in one format"""
+    entries = {}
+    for size in THUMB_SIZES:
+        # Levels are bounded on the long side and never upscaled; srcset wants the real width,
+        # and small originals produce identical levels that must only be listed once
+        scale = min(1.0, size / max(image.width or size, image.height or size, 1))
+        width = max(1, round((image.width or size) * scale))
+        entries.setdefault(width, f"{thumb_url(image.filename, size, fmt)} {width}w")
+    return ", ".join(entries.values())
+
+templates.env.globals["thumb_srcset"] = thumb_srcset
+templates.env.globals["thumb_url"] = thumb_url
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 def get_db():
@@ -109,268 +116,526 @@ def get_db():
     try: yield db
     finally: db.close()
 
-# Global display queue and thread management
-DISPLAY_QUEUE = queue.Queue()
-DISPLAY_THREAD = {"t": None, "stop": False}
-SLIDESHOW_THREAD = {"t": None, "stop": False}
+# Slideshow timeline: "slot" is when the last slot ran (monotonic clock), "job" the planned next slot
+SLIDESHOW = {"job": None, "slot": None, "next_id": None}
+SLIDESHOW_LOCK = threading.Lock()
 
-# Global upload queue and status tracking
-UPLOAD_QUEUE = queue.Queue()
-UPLOAD_STATUS: Dict[str, Any] = {}  # task_id -> status info
-UPLOAD_THREAD = {"t": None, "stop": False}
+# Upload task status lives in utils/task_store
+UPLOAD_POOL = {"executor": None}
+# Uploads are spooled here before the upload job moves them into the image directory
+UPLOAD_STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", "cache/staging")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Processes used for decode/EXIF/thumbnail work; 1 disables the pool. Each busy worker holds a
+# CPU slot, so more workers than jobs.CPU_SLOTS would never all be used.
+UPLOAD_WORKERS = max(1, int(os.getenv("UPLOAD_WORKERS", jobs.CPU_SLOTS)))
 
-def display_worker():
-    """Worker thread that processes display queue in background"""
-    while not DISPLAY_THREAD["stop"]:
-        try:
-            # Wait for display request with timeout
-            display_request = DISPLAY_QUEUE.get(timeout=1)
-            if display_request is None:  # Shutdown signal
-                break
-                
-            image_path, image_id = display_request
-            print(f"[DISPLAY] Processing: {image_path}")
-            
-            # This is the potentially slow operation
-            eframe_inky.show_on_inky(image_path)
-            
-            # Update database stats in background
-            if image_id:
-                try:
-                    with SessionLocal() as db:
-                        img = db.get(Image, image_id)
-                        if img:
-                            img.times_shown += 1
-                            img.last_shown_at = datetime.now(timezone.utc)
-                            db.commit()
-                except Exception as e:
-                    print(f"Error updating display stats: {e}")
-                    
-            DISPLAY_QUEUE.task_done()
+def display_job():
+    """Show the newest waiting display request; bursts arrive here already coalesced"""
+    display_request = display_queue.take(timeout=0)
+    if display_request is None:
+        return  # Taken by an earlier display job, or discarded at shutdown
+    try:
+        frame, image_id = display_request
+        display_log.info("Processing: frame %s (%s)", frame["generation"], frame["version"])
+        
+        # Browsers showing the frame fetch the new image only when told it changed
+        events.publish("frame", {"version": frame["version"], "image_id": image_id})
+        
+        # This is the potentially slow operation; the panel gets the pre-dithered pixels, not a JPEG
+        eframe_inky.show_on_inky(frame["panel"] if frame["panel"] is not None else frame["image"])
+        
+        if image_id:
+            # Only a frame that reached the panel moves its image to the back of the rotation
+            play_queue.played(image_id)
+            # The rotation moved on, so pick and render the following slideshow image now;
+            # low priority, so a "show now" render still goes first
+            jobs.submit("render", prepare_next_job, priority=jobs.PRIORITY_LOW, key="prepare")
             
-        except queue.Empty:
-            continue  # Check stop flag and try again
-        except Exception as e:
-            print(f"Display worker error: {e}")
+            # Update database stats
+            try:
+                with SessionLocal() as db:
+                    img = db.get(Image, image_id)
+                    if img:
+                        img.times_shown += 1
+                        img.last_shown_at = datetime.now(timezone.utc)
+                        db.commit()
+            except Exception as e:
+                display_log.error("Error updating display stats: %s", e)
+    finally:
+        display_queue.done()
 
-def queue_display(image_path, image_id=None):
-    """Queue an image for display on the e-ink screen"""
-    try:
-        DISPLAY_QUEUE.put((image_path, image_id), block=False)
-        print(f"[DISPLAY] Queued: {image_path}")
+def backfill_job(position=None, filled: int = 0):
+    """
+    One batch of the startup backfills. The next batch is a new job, so a render or slideshow
+    slot waiting for the CPU gets it between batches instead of after the whole library.
+    """
+    position, name, count = migrations.backfill_batch(engine.url.database, position)
+    filled += count
+    if position is None:
+        if filled:
+            log.info("Backfills complete: %d images updated", filled)
+        return
+    jobs.submit("thumbnail", backfill_job, position, filled,
+                priority=jobs.PRIORITY_LOW, delay=migrations.BACKFILL_PAUSE)
+
+def frame_version() -> str | None:
+    """Content hash of the current frame, used in its versioned URL and as its ETag"""
+    return frame_store.version()
+
+def queue_display(frame, image_id=None, priority=display_queue.PRIORITY_MANUAL):
+    """
+    Queue a published frame (see frame_store.publish) for display on the e-ink screen.
+    Replaces any request still waiting for the panel; returns False if the frame was dropped
+    because a more urgent request is waiting.
+    """
+    if display_queue.submit((frame, image_id), priority):
+        # One display job waiting is enough: it shows whatever request is newest when it starts
+        jobs.submit("display", display_job, key="display")
+        display_log.debug("Queued: frame %s", frame["generation"])
         return True
-    except queue.Full:
-        print("[DISPLAY] Warning: Display queue is full, skipping")
-        return False
+    display_log.info("Dropped frame %s: a manual request is waiting", frame["generation"])
+    return False
 
-def start_display_worker():
-    """Start the background display worker thread"""
-    if DISPLAY_THREAD["t"] is None or not DISPLAY_THREAD["t"].is_alive():
-        DISPLAY_THREAD["stop"] = False
-        DISPLAY_THREAD["t"] = threading.Thread(target=display_worker, daemon=True)
-        DISPLAY_THREAD["t"].start()
-        print("[DISPLAY] Worker thread started")
-
-def stop_display_worker():
-    """Stop the background display worker thread"""
-    DISPLAY_THREAD["stop"] = True
-    DISPLAY_QUEUE.put(None)  # Signal shutdown
-    if DISPLAY_THREAD["t"] and DISPLAY_THREAD["t"].is_alive():
-        DISPLAY_THREAD["t"].join(timeout=5)
-        print("[DISPLAY] Worker thread stopped")
-
-def upload_worker():
-    """Worker thread that processes upload queue in background"""
-    worker_id = threading.current_thread().ident
-    print(f"[UPLOAD] Worker {worker_id} started")
-    
-    while not UPLOAD_THREAD["stop"]:
-        try:
-            upload_task = UPLOAD_QUEUE.get(timeout=1)
-            if upload_task is None:  # Shutdown signal
-                break
-                
-            task_id, files_data, title, description = upload_task
-            print(f"[UPLOAD] Worker {worker_id} processing task {task_id} with {len(files_data)} files")
-            
-            # Check if this task is already being processed
-            if task_id in UPLOAD_STATUS and UPLOAD_STATUS[task_id]["status"] == "processing":
-                print(f"[UPLOAD] ERROR: Task {task_id} is already being processed! Skipping duplicate.")
-                UPLOAD_QUEUE.task_done()
+def upload_job(task_id: str):
+    """
+    Store, process and register one upload batch (runs as an "upload" job).
+    Safe to run again for a task interrupted by a restart: files already registered are
+    skipped and originals already moved into the library are reused.
+    """
+    task = task_store.payload(task_id)
+    if task is None:
+        return  # Evicted or discarded while queued
+    files = task["files"]  # [original name, staged path, content hash, stored name or None]
+    done = set(task["done"])
+    title, description, skip_duplicates = task["title"], task["description"], task["skip_duplicates"]
+    upload_log.info("Processing task %s with %d files (%d already done)", task_id, len(files), len(done))
+    repeated = {name: count for name, count in Counter(f[0] for f in files).items() if count > 1}
+    if repeated:
+        upload_log.warning("Task %s has repeated filenames: %s", task_id, repeated)
+    
+    task_store.update(task_id, status="processing", current_file=None)
+    publish_upload_status(task_id)
+    
+    # Get database session
+    db = SessionLocal()
+    try:
+        s = settings_cache.get(db)
+        uploaded_count = task_store.get(task_id)["uploaded"]
+        
+        # Stage 1: write originals to disk and fan decode/EXIF/thumbnail work out to the pool
+        pending = []
+        batch_hashes = set()
+        for i, (filename, staged_path, content_hash, stored_name) in enumerate(files):
+            if i in done:
                 continue
-            
-            # Update status
-            UPLOAD_STATUS[task_id] = {
-                "status": "processing", 
-                "progress": 0, 
-                "total": len(files_data),
-                "uploaded": 0,
-                "errors": [],
-                "started_at": datetime.now(),
-                "last_activity": datetime.now(),
-                "current_file": None
-            }
-            
-            # Get database session
-            db = SessionLocal()
+            if jobs.cancelled():
+                return interrupt_upload(task_id)
             try:
-                s = db.query(Settings).first()
-                uploaded_count = 0
+                task_store.update(task_id, current_file=filename)
                 
-                for i, (filename, file_content) in enumerate(files_data):
-                    try:
-                        # Update progress
-                        UPLOAD_STATUS[task_id]["progress"] = i
-                        UPLOAD_STATUS[task_id]["current_file"] = filename
-                        UPLOAD_STATUS[task_id]["last_activity"] = datetime.now()
-                        print(f"[UPLOAD] Processing {i+1}/{len(files_data)}: {filename} ({len(file_content)} bytes)")
-                        
-                        # Check for duplicate files in the current batch
-                        duplicate_in_batch = sum(1 for f, _ in files_data if f == filename)
-                        if duplicate_in_batch > 1:
-                            print(f"[UPLOAD] WARNING: Found {duplicate_in_batch} instances of {filename} in current batch!")
-                        
-                        # Use filename as title if no default title provided
-                        file_title = title if title.strip() else os.path.splitext(filename)[0]
-                        
-                        # Create a file-like object from bytes
-                        from io import BytesIO
-                        file_obj = type('UploadFile', (), {
-                            'filename': filename,
-                            'file': BytesIO(file_content)
-                        })()
-                        
-                        print(f"[UPLOAD] Saving file: {filename} ({len(file_content)} bytes)")
-                        UPLOAD_STATUS[task_id]["last_activity"] = datetime.now()
-                        fname, w, h, exif_json = save_upload(file_obj, s.image_root, s.thumb_root)
-                        print(f"[UPLOAD] File saved as: {fname} ({w}x{h})")
-                        
-                        # Check if this filename already exists in database
-                        existing_img = db.query(Image).filter(Image.filename == fname).first()
-                        if existing_img:
-                            print(f"[UPLOAD] WARNING: File {fname} already exists in database, skipping")
-                            continue
-                        
-                        # Calculate smart default crop
-                        UPLOAD_STATUS[task_id]["last_activity"] = datetime.now()
-                        crop_x, crop_y, crop_width, crop_height = calculate_smart_crop(w, h, s.resolution)
-                        
-                        # Add to database
-                        UPLOAD_STATUS[task_id]["last_activity"] = datetime.now()
-                        max_order = db.query(Image).count()
-                        img = Image(filename=fname, original_name=filename, title=file_title,
-                                    description=description, exif_json=exif_json,
-                                    width=w, height=h, sort_order=max_order+1,
-                                    crop_x=crop_x, crop_y=crop_y, 
-                                    crop_width=crop_width, crop_height=crop_height)
-                        db.add(img)
-                        
-                        # Flush to check for any database errors before continuing
-                        try:
-                            db.flush()
-                            uploaded_count += 1
-                            UPLOAD_STATUS[task_id]["uploaded"] = uploaded_count
-                            UPLOAD_STATUS[task_id]["last_activity"] = datetime.now()
-                            print(f"[UPLOAD] Successfully processed: {filename} (crop: {crop_x:.1f}%, {crop_y:.1f}%, {crop_width:.1f}%x{crop_height:.1f}%)")
-                        except Exception as db_error:
-                            print(f"[UPLOAD] Database error for {filename}: {db_error}")
-                            db.rollback()
-                            # Continue with next file
-                            continue
-                        
-                    except Exception as e:
-                        error_msg = f"Failed to upload {filename}: {str(e)}"
-                        print(f"[UPLOAD] ERROR: {error_msg}")
-                        import traceback
-                        traceback.print_exc()
-                        UPLOAD_STATUS[task_id]["errors"].append(error_msg)
+                if stored_name:
+                    # Moved into the library before a restart; the row may even have been committed
+                    if db.query(Image.id).filter(Image.filename == stored_name).first():
+                        uploaded_count += 1
+                        done.add(i)
+                        task_store.update(task_id, uploaded=uploaded_count)
+                        task_store.set_payload(task_id, done=sorted(done))
                         continue
+                    if not os.path.exists(os.path.join(s.image_root, stored_name)):
+                        raise FileNotFoundError("stored original is missing")
+                    fname = stored_name
+                else:
+                    if not os.path.exists(staged_path):
+                        raise FileNotFoundError("staged upload is missing")
+                    if content_hash is None:
+                        # Chunked uploads arrive out of order, so they are hashed here, off the request path
+                        content_hash = files[i][2] = file_hash(staged_path)
+                    
+                    # Known content short-circuits before any disk write, decode or thumbnail
+                    if skip_duplicates and (content_hash in batch_hashes or
+                                            db.query(Image.id).filter(Image.content_hash == content_hash).first()):
+                        upload_log.debug("Skipping duplicate: %s (hash: %.16s)", filename, content_hash)
+                        task_store.append(task_id, "duplicates", filename)
+                        publish_upload_status(task_id)
+                        discard_staged(staged_path)
+                        done.add(i)
+                        task_store.set_payload(task_id, done=sorted(done))
+                        continue
+                    
+                    if upload_log.isEnabledFor(logging.DEBUG):
+                        upload_log.debug("Saving %d/%d: %s (%d bytes)", i+1, len(files), filename, os.path.getsize(staged_path))
+                    
+                    fname = store_upload(staged_path, filename, s.image_root)
+                    # Record the move at once: after a restart the staged file is gone
+                    files[i][3] = fname
+                    task_store.set_payload(task_id, files=files)
+                batch_hashes.add(content_hash)
                 
-                db.commit()
-                
-                # Mark as completed
-                UPLOAD_STATUS[task_id]["status"] = "completed"
-                UPLOAD_STATUS[task_id]["progress"] = len(files_data)
-                UPLOAD_STATUS[task_id]["current_file"] = None
-                print(f"[UPLOAD] Task {task_id} completed: {uploaded_count} of {len(files_data)} images")
+                future = submit_upload_processing(os.path.join(s.image_root, fname), s.thumb_root, s.resolution)
+                pending.append((i, filename, fname, content_hash, future))
                 
             except Exception as e:
-                db.rollback()
-                UPLOAD_STATUS[task_id]["status"] = "error"
-                UPLOAD_STATUS[task_id]["errors"].append(f"Database error: {str(e)}")
-                print(f"[UPLOAD] Task {task_id} failed: {e}")
-                import traceback
-                traceback.print_exc()
-            finally:
-                db.close()
-                UPLOAD_QUEUE.task_done()
+                error_msg = f"Failed to upload {filename}: {str(e)}"
+                upload_log.error(error_msg)
+                task_store.append(task_id, "errors", error_msg)
+                publish_upload_status(task_id)
+                discard_staged(staged_path)
+                done.add(i)
+                task_store.set_payload(task_id, done=sorted(done))
+        
+        # Stage 2: single writer commits DB rows in upload order as results arrive
+        for n, (i, filename, fname, content_hash, future) in enumerate(pending):
+            if jobs.cancelled():
+                return interrupt_upload(task_id)
+            try:
+                # Update progress
+                task_store.update(task_id, progress=i, current_file=filename)
+                publish_upload_status(task_id)
                 
-        except queue.Empty:
-            continue  # Check stop flag and try again
+                try:
+                    w, h, exif_json, thumb_formats, crop = future.result()
+                except Exception:
+                    # Don't leave an orphaned original behind for a file we couldn't read
+                    p = os.path.join(s.image_root, fname)
+                    if os.path.exists(p): os.remove(p)
+                    done.add(i)
+                    task_store.set_payload(task_id, done=sorted(done))
+                    raise
+                upload_log.debug("Processed %d/%d: %s (%dx%d)", n+1, len(pending), fname, w, h)
+                
+                # Use filename as title if no default title provided
+                file_title = title if title.strip() else os.path.splitext(filename)[0]
+                
+                # Default crop: positioned by saliency in the worker, else centred
+                crop_x, crop_y, crop_width, crop_height = crop or calculate_smart_crop(w, h, s.resolution)
+                
+                # Add to database
+                task_store.touch(task_id)
+                max_order = db.query(func.coalesce(func.max(Image.sort_order), 0)).scalar()
+                img = Image(filename=fname, content_hash=content_hash,
+                            original_name=filename, title=file_title,
+                            description=description, exif_json=exif_json,
+                            thumb_formats=thumb_formats,
+                            width=w, height=h, sort_order=max_order+1,
+                            crop_x=crop_x, crop_y=crop_y, 
+                            crop_width=crop_width, crop_height=crop_height)
+                db.add(img)
+                
+                # Commit per image, so a restart resumes after the last registered file
+                try:
+                    db.commit()
+                except Exception as db_error:
+                    upload_log.error("Database error for %s: %s", filename, db_error)
+                    db.rollback()
+                    # Continue with next file
+                    continue
+                
+                # New images join the slideshow rotation ahead of everything already shown
+                play_queue.add(img.id)
+                uploaded_count += 1
+                done.add(i)
+                task_store.update(task_id, uploaded=uploaded_count)
+                task_store.set_payload(task_id, done=sorted(done))
+                publish_upload_status(task_id)
+                upload_log.debug("Successfully processed: %s (crop: %.1f%%, %.1f%%, %.1f%%x%.1f%%)", filename, crop_x, crop_y, crop_width, crop_height)
+                
+            except Exception as e:
+                error_msg = f"Failed to upload {filename}: {str(e)}"
+                upload_log.exception(error_msg)
+                task_store.append(task_id, "errors", error_msg)
+                publish_upload_status(task_id)
+                continue
+        
+        # Mark as completed, unless the watchdog already gave up on this task
+        if task_store.get(task_id)["status"] == "processing":
+            task_store.update(task_id, status="completed", progress=len(files), current_file=None)
+            # The resume information is no longer needed
+            task_store.set_payload(task_id, files=[], done=[])
+            publish_upload_status(task_id)
+        upload_log.info("Task %s completed: %d of %d images", task_id, uploaded_count, len(files))
+        
+    except Exception as e:
+        db.rollback()
+        task_store.append(task_id, "errors", f"Database error: {str(e)}")
+        task_store.update(task_id, status="error", current_file=None)
+        publish_upload_status(task_id)
+        upload_log.exception("Task %s failed: %s", task_id, e)
+    finally:
+        db.close()
+
+def interrupt_upload(task_id: str):
+    """Stop an upload job asked to stop between files; at shutdown the task stays queued to resume"""
+    status = task_store.get(task_id)
+    if status and status["status"] == "processing":
+        task_store.update(task_id, status="queued", current_file=None)
+        publish_upload_status(task_id)
+    upload_log.info("Task %s interrupted", task_id)
+
+def queue_upload(task_id: str) -> bool:
+    """Queue the upload job for a task in the store; False if the scheduler is shut down"""
+    job = jobs.submit("upload", upload_job, task_id)
+    if job is None:
+        return False
+    task_store.set_payload(task_id, job=job["id"])
+    schedule_upload_watchdog()
+    return True
+
+# Seconds between watchdog passes while any upload task is active
+UPLOAD_WATCHDOG_INTERVAL = 30
+
+def upload_watchdog_job():
+    """Fail upload tasks that stopped making progress and evict expired ones, without waiting for a poll"""
+    for task_id, reason in task_store.stuck():
+        task_store.append(task_id, "errors", reason)
+        task_store.update(task_id, status="error", current_file=None)
+        jobs.cancel((task_store.payload(task_id) or {}).get("job"))
+        publish_upload_status(task_id)
+        upload_log.warning("Task %s: %s", task_id, reason)
+    for task_id in task_store.evict():
+        discard_task_staging(task_id)
+    # Only keep watching while there is something to watch, so an idle frame stays idle
+    if task_store.active(task_store.ACTIVE_STATES + (task_store.RECEIVING,)) and not jobs.cancelled():
+        schedule_upload_watchdog()
+
+def schedule_upload_watchdog():
+    jobs.submit("watchdog", upload_watchdog_job, delay=UPLOAD_WATCHDOG_INTERVAL, key="upload-watchdog")
+
+def publish_upload_status(task_id: str):
+    """Push the current state of an upload task to subscribed browsers"""
+    status = task_store.get(task_id)
+    if status is not None:
+        events.publish("upload", {"task_id": task_id, **status})
+
+def discard_task_staging(task_id: str):
+    """Remove whatever a task still has in the staging directory (abandoned upload sessions)"""
+    if not os.path.isdir(UPLOAD_STAGING_DIR):
+        return
+    for name in os.listdir(UPLOAD_STAGING_DIR):
+        if name.startswith(f"{task_id}-"):
+            discard_staged(os.path.join(UPLOAD_STAGING_DIR, name))
+
+def clean_staging(keep: set[str]):
+    """Remove staged uploads that no task will process"""
+    if not os.path.isdir(UPLOAD_STAGING_DIR):
+        return
+    for name in os.listdir(UPLOAD_STAGING_DIR):
+        path = os.path.join(UPLOAD_STAGING_DIR, name)
+        if path not in keep:
+            discard_staged(path)
+
+def discard_staged(staged_path: str):
+    """Remove a staged upload that will not be processed"""
+    try:
+        os.remove(staged_path)
+    except OSError:
+        pass
+
+def submit_upload_processing(dest_path: str, thumb_root: str, resolution: str | None = None) -> Future:
+    """
+    Run decode/EXIF/thumbnail/crop work for one stored upload on the process pool. The work holds a
+    CPU slot until it finishes, so uploads share cores with renders; this waits for a free slot first.
+    """
+    jobs.take_cpu_slot()
+    pool = UPLOAD_POOL["executor"]
+    if pool is None:
+        # Single-core boards: process inline rather than paying for a worker process
+        future = Future()
+        try:
+            future.set_result(process_upload(dest_path, thumb_root, resolution))
         except Exception as e:
-            print(f"Upload worker error: {e}")
-
-def start_upload_worker():
-    """Start the background upload worker thread"""
-    print(f"[UPLOAD] start_upload_worker called. Current thread: {UPLOAD_THREAD['t']}")
-    if UPLOAD_THREAD["t"] is None or not UPLOAD_THREAD["t"].is_alive():
-        UPLOAD_THREAD["stop"] = False
-        UPLOAD_THREAD["t"] = threading.Thread(target=upload_worker, daemon=True)
-        UPLOAD_THREAD["t"].start()
-        print(f"[UPLOAD] Worker thread started: {UPLOAD_THREAD['t'].ident}")
-    else:
-        print(f"[UPLOAD] Worker thread already running: {UPLOAD_THREAD['t'].ident}")
+            future.set_exception(e)
+        finally:
+            jobs.release_cpu_slot()
+        return future
+    try:
+        future = pool.submit(process_upload, dest_path, thumb_root, resolution)
+    except Exception:
+        jobs.release_cpu_slot()
+        raise
+    future.add_done_callback(lambda _: jobs.release_cpu_slot())
+    return future
+
+def start_upload_pool():
+    """Start the process pool for decode/EXIF/thumbnail work (not used on single-core boards)"""
+    if UPLOAD_POOL["executor"] is None and UPLOAD_WORKERS > 1:
+        # spawn, not fork: forking a process that already runs threads is unsafe
+        UPLOAD_POOL["executor"] = ProcessPoolExecutor(max_workers=UPLOAD_WORKERS,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+        upload_log.info("Processing pool started with %d workers", UPLOAD_WORKERS)
+
+def stop_upload_pool():
+    if UPLOAD_POOL["executor"] is not None:
+        UPLOAD_POOL["executor"].shutdown(wait=False, cancel_futures=True)
+        UPLOAD_POOL["executor"] = None
+
+# Cards rendered per gallery page (first paint and each infinite-scroll fetch)
+GALLERY_PAGE_SIZE = 24
+
+def encode_gallery_cursor(sort_order, created_at_raw, image_id) -> str:
+    raw = f"{sort_order}|{created_at_raw or ''}|{image_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_gallery_cursor(cursor: str) -> tuple[int, str, int]:
+    try:
+        sort_order, created_at_raw, image_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return int(sort_order), created_at_raw, int(image_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def gallery_page(db: Session, cursor: str | None = None, limit: int = GALLERY_PAGE_SIZE) -> tuple[list[Image], str | None]:
+    """
+    One page of the library in display order (sort_order, created_at, id) using keyset pagination,
+    so every page costs the same regardless of how deep into the library it is.
+    """
+    # Compare created_at as the stored text: it is what the ORDER BY sorts on, and
+    # server-default timestamps don't round-trip through a Python datetime unchanged
+    created_raw = type_coerce(Image.created_at, String)
+    q = db.query(Image, created_raw)
+    if cursor:
+        after = decode_gallery_cursor(cursor)
+        q = q.filter(tuple_(Image.sort_order, func.coalesce(created_raw, ""), Image.id) > after)
+    rows = q.order_by(Image.sort_order.asc(), Image.created_at.asc(), Image.id.asc()).limit(limit + 1).all()
 
-def stop_upload_worker():
-    """Stop the background upload worker thread"""
-    UPLOAD_THREAD["stop"] = True
-    UPLOAD_QUEUE.put(None)  # Signal shutdown
-    if UPLOAD_THREAD["t"] and UPLOAD_THREAD["t"].is_alive():
-        UPLOAD_THREAD["t"].join(timeout=5)
-        print("[UPLOAD] Worker thread stopped")
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, last_created = rows[-1]
+        next_cursor = encode_gallery_cursor(last.sort_order, last_created, last.id)
+    return [img for img, _ in rows], next_cursor
 
 @app.get("/", name="home")
 def index(request: Request, db: Session = Depends(get_db)):
-    print(f"[INDEX] Index page requested at {datetime.now()}")
-    print(f"[INDEX] Request method: {request.method}")
-    print(f"[INDEX] Request headers: {dict(request.headers)}")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Index page requested, headers: %s", dict(request.headers))
     
-    imgs = db.query(Image).order_by(Image.sort_order.asc(), Image.created_at.asc()).all()
-    settings = db.query(Settings).first()
+    # Only the first page is rendered server-side; the rest streams in as the user scrolls
+    imgs, next_cursor = gallery_page(db)
+    settings = settings_cache.get(db)
     
     # Check if current.jpg file actually exists
-    current_image_exists = os.path.exists("static/current.jpg")
+    current_image_exists = frame_version() is not None
     
-    print(f"[INDEX] Found {len(imgs)} images, current_image_exists: {current_image_exists}")
+    log.debug("Index rendered %d images, current_image_exists: %s", len(imgs), current_image_exists)
     
     return templates.TemplateResponse("index.html", {
         "request": request, 
         "images": imgs, 
+        "next_cursor": next_cursor,
         "settings": settings,
         "current_image_exists": current_image_exists,
+        "frame_version": frame_version() if current_image_exists else None,
         "dev_mode": is_dev_mode()
     })
 
+@app.get("/api/images")
+def list_images(cursor: str | None = None, limit: int = GALLERY_PAGE_SIZE, db: Session = Depends(get_db)):
+    """Paginated library listing; `html` holds the rendered cards for the index page"""
+    limit = max(1, min(limit, 100))
+    imgs, next_cursor = gallery_page(db, cursor, limit)
+    card = templates.get_template("partials/_image_card.html")
+    return {
+        "items": [
+            {
+                "id": img.id,
+                "filename": img.filename,
+                "title": img.title or img.original_name,
+                "enabled": img.enabled,
+                "sort_order": img.sort_order,
+                "width": img.width,
+                "height": img.height,
+                "times_shown": img.times_shown,
+            }
+            for img in imgs
+        ],
+        "html": "".join(card.render(image=img) for img in imgs),
+        "next_cursor": next_cursor,
+    }
+
 @app.get("/frame", name="frame")
 def frame_view(request: Request):
     """Frame view - shows just the current image, auto-refreshing for slideshow testing"""
-    print(f"[FRAME] Frame view requested at {datetime.now()}")
-    
     # Check if current.jpg file actually exists
-    current_image_exists = os.path.exists("static/current.jpg")
+    current_image_exists = frame_version() is not None
     
     # Get timestamp for cache busting
     timestamp = int(datetime.now().timestamp() * 1000)
+    version = frame_version()
     
-    print(f"[FRAME] current_image_exists: {current_image_exists}, timestamp: {timestamp}")
+    log.debug("Frame view: current_image_exists: %s, timestamp: %s", current_image_exists, timestamp)
     
     return templates.TemplateResponse("frame.html", {
         "request": request,
         "current_image_exists": current_image_exists,
         "timestamp": timestamp,
+        "frame_version": version,
         "dev_mode": is_dev_mode()
     })
 
+@app.get("/display/status")
+def display_status():
+    """Display queue depth, whether the panel is refreshing, and how many requests were coalesced"""
+    return {**display_queue.stats(), "jobs": jobs.stats(), "upload_tasks": task_store.stats()}
+
+@app.get("/logging")
+def get_logging():
+    """Current log levels, app-wide and per area"""
+    return {"levels": logs.levels(), "available": list(logs.LEVELS)}
+
+@app.post("/logging")
+async def set_logging(request: Request):
+    """
+    Change a log level without restarting: {"level": "DEBUG"} for all app logging, or
+    {"level": "DEBUG", "logger": "upload"} for one area ("NOTSET" returns it to the app-wide level)
+    """
+    try:
+        body = await request.json()
+        level = logs.set_level(str(body["level"]), body.get("logger"))
+    except (ValueError, KeyError, TypeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    log.warning("Log level of %s set to %s", body.get("logger") or "all areas", level)
+    return {"levels": logs.levels()}
+
+# Versioned frame URLs never change content, so browsers may keep them forever
+FRAME_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+def frame_response(request: Request, frame, cache_control: str, media_type: str = "image/jpeg"):
+    """Serve a frame with validators, answering conditional requests with 304"""
+    data, version, mtime = frame
+    headers = {
+        "ETag": frame_store.etag(version),
+        "Last-Modified": frame_store.last_modified(mtime),
+        "Cache-Control": cache_control,
+    }
+    if frame_store.not_modified(request.headers, version, mtime):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+@app.get("/frame/current.jpg", name="current_frame")
+def current_frame(request: Request):
+    """Latest frame; clients revalidate on every use, which costs a 304 while it is unchanged"""
+    frame = frame_store.load()
+    if frame is None:
+        return JSONResponse({"error": "no frame rendered yet"}, status_code=404)
+    return frame_response(request, frame, "no-cache")
+
+@app.get("/frame/panel.png", name="panel_preview")
+def panel_preview(request: Request):
+    """The current frame as the e-ink panel will show it: panel colours, dithered"""
+    frame = frame_store.load_panel()
+    if frame is None:
+        return JSONResponse({"error": "no dithered frame available"}, status_code=404)
+    return frame_response(request, frame, "no-cache", "image/png")
+
+@app.get("/frame/{version}.jpg", name="frame_at_version")
+def frame_at_version(version: str, request: Request):
+    """Content-addressed frame URL, as published in frame events; recent versions stay available"""
+    frame = frame_store.load_version(version)
+    if frame is None:
+        # Rotated out of the frame ring; send the client to the latest frame
+        return RedirectResponse(request.url_for("current_frame"), status_code=307,
+                                headers={"Cache-Control": "no-store"})
+    return frame_response(request, frame, FRAME_IMMUTABLE_CACHE)
+
 @app.get("/upload", name="upload")
 def upload_form(request: Request):
     return templates.TemplateResponse("upload.html", {
@@ -378,47 +643,37 @@ def upload_form(request: Request):
         "dev_mode": is_dev_mode()
     })
 
+def spool_chunk(out, hasher, chunk: bytes):
+    hasher.update(chunk)
+    out.write(chunk)
+
 @app.post("/upload")
 async def upload(request: Request):
-    print(f"[UPLOAD] Upload endpoint called at {datetime.now()}")
-    
-    # Log user agent for Safari detection
-    user_agent = request.headers.get("user-agent", "")
-    is_safari_ios = "iPhone" in user_agent or "iPad" in user_agent or "iPod" in user_agent
-    print(f"[UPLOAD] User-Agent: {user_agent}")
-    print(f"[UPLOAD] Safari iOS detected: {is_safari_ios}")
+    upload_log.debug("Upload endpoint called, User-Agent: %s", request.headers.get("user-agent", ""))
     
     try:
         form = await request.form()
-        print(f"[UPLOAD] Form keys: {list(form.keys())}")
         
         # Get title and description
         title = form.get("title", "")
         description = form.get("description", "")
-        print(f"[UPLOAD] Title: '{title}', Description: '{description}'")
+        # Opt-in: skip files whose content is already in the library
+        skip_duplicates = form.get("skip_duplicates", "") in ("1", "true", "on")
         
         # Get files - FastAPI/Starlette handles multiple files from single input differently
         files = form.getlist("files")
-        print(f"[UPLOAD] Received {len(files)} files")
-        
-        # Safari iOS specific validation
-        if is_safari_ios and len(files) > 5:
-            print(f"[UPLOAD] WARNING: Safari iOS uploading {len(files)} files - may be unstable")
-        
-        # Debug: Check for duplicate files in the form data
         file_names = [getattr(f, 'filename', 'no-name') for f in files if hasattr(f, 'filename')]
-        print(f"[UPLOAD] File names: {file_names}")
+        upload_log.debug("Received %d files: %s", len(files), file_names)
         
     except Exception as e:
-        print(f"[UPLOAD] Error reading form data: {e}")
+        upload_log.error("Error reading form data: %s", e)
         return JSONResponse({"error": f"Failed to read upload data: {str(e)}"}, status_code=400)
     
     # Count duplicates
-    from collections import Counter
     name_counts = Counter(file_names)
     duplicates = {name: count for name, count in name_counts.items() if count > 1}
     if duplicates:
-        print(f"[UPLOAD] WARNING: Duplicate filenames in form data: {duplicates}")
+        upload_log.warning("Duplicate filenames in form data: %s", duplicates)
     
     if not files or not any(hasattr(f, 'filename') and f.filename for f in files):
         return JSONResponse({"error": "No valid files provided"}, status_code=400)
@@ -426,29 +681,41 @@ async def upload(request: Request):
     # Generate unique task ID
     task_id = str(uuid.uuid4())
     
-    # Read file contents into memory (since we can't pass file objects between threads)
-    # Safari iOS specific: Add better error handling for file reading
+    # Spool each file to the staging directory in fixed-size chunks, hashing as we go,
+    # so memory use is bounded by the chunk size rather than the batch size
+    ensure_dirs(UPLOAD_STAGING_DIR)
     files_data = []
     failed_files = []
     
     for i, file in enumerate(files):
         if hasattr(file, 'filename') and file.filename:
+            staged_path = os.path.join(UPLOAD_STAGING_DIR, f"{task_id}-{i}")
             try:
-                print(f"[UPLOAD] Reading file {i+1}/{len(files)}: {file.filename}")
-                content = await file.read()
+                upload_log.debug("Reading file %d/%d: %s", i+1, len(files), file.filename)
+                hasher = hashlib.sha256()
+                size = 0
+                with open(staged_path, "wb") as out:
+                    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                        # Hashing and writing a megabyte is real work; keep it off the event loop
+                        await jobs.offload(spool_chunk, out, hasher, chunk)
+                        size += len(chunk)
                 
-                if len(content) == 0:
-                    print(f"[UPLOAD] WARNING: File {file.filename} is empty, skipping")
+                if size == 0:
+                    upload_log.warning("File %s is empty, skipping", file.filename)
                     failed_files.append(f"{file.filename} (empty file)")
+                    discard_staged(staged_path)
                     continue
                     
-                files_data.append((file.filename, content))
-                print(f"[UPLOAD] Successfully queued: {file.filename} ({len(content)} bytes)")
+                files_data.append((file.filename, staged_path, hasher.hexdigest()))
+                upload_log.debug("Successfully queued: %s (%d bytes)", file.filename, size)
                 
             except Exception as e:
-                print(f"[UPLOAD] ERROR: Failed to read file {file.filename}: {e}")
+                upload_log.error("Failed to read file %s: %s", file.filename, e)
                 failed_files.append(f"{file.filename} (read error: {str(e)})")
+                discard_staged(staged_path)
                 continue
+            finally:
+                await file.close()
     
     if not files_data:
         error_msg = "No files could be processed"
@@ -457,82 +724,251 @@ async def upload(request: Request):
         return JSONResponse({"error": error_msg}, status_code=400)
     
     if failed_files:
-        print(f"[UPLOAD] WARNING: Some files failed to process: {failed_files}")
+        upload_log.warning("Some files failed to process: %s", failed_files)
     
-    print(f"[UPLOAD] Total files to queue: {len(files_data)} (failed: {len(failed_files)})")
+    upload_log.debug("Total files to queue: %d (failed: %d)", len(files_data), len(failed_files))
     
     # Log file details for debugging
-    file_hashes = {}
-    for i, (filename, content) in enumerate(files_data):
-        content_hash = hashlib.sha256(content).hexdigest()[:16]
-        print(f"[UPLOAD] File {i+1}: {filename} ({len(content)} bytes, hash: {content_hash})")
-        if content_hash in file_hashes:
-            print(f"[UPLOAD] WARNING: Duplicate content detected! Same content as file {file_hashes[content_hash]}")
-        else:
-            file_hashes[content_hash] = filename
+    if upload_log.isEnabledFor(logging.DEBUG):
+        file_hashes = {}
+        for i, (filename, staged_path, content_hash) in enumerate(files_data):
+            upload_log.debug("File %d: %s (%d bytes, hash: %.16s)", i+1, filename, os.path.getsize(staged_path), content_hash)
+            if content_hash in file_hashes:
+                upload_log.debug("Same content as file %s", file_hashes[content_hash])
+            else:
+                file_hashes[content_hash] = filename
     
-    # Queue the upload task
-    UPLOAD_QUEUE.put((task_id, files_data, title, description))
-    
-    # Initialize status tracking
-    UPLOAD_STATUS[task_id] = {
+    # Record the task before queueing, so the job's own updates can't be overwritten; the
+    # payload is everything needed to run it again after a restart
+    task_store.create(task_id, {
         "status": "queued", 
         "progress": 0, 
         "total": len(files_data),
         "uploaded": 0,
-        "errors": []
-    }
+        "errors": [],
+        "duplicates": [],
+        "current_file": None
+    }, {
+        "files": [[filename, staged_path, content_hash, None] for filename, staged_path, content_hash in files_data],
+        "done": [],
+        "title": title,
+        "description": description,
+        "skip_duplicates": skip_duplicates,
+        "job": None
+    })
     
-    print(f"Upload task {task_id} queued with {len(files_data)} files")
+    # Queue the upload task
+    if not queue_upload(task_id):
+        task_store.discard(task_id)
+        for _, staged_path, _ in files_data:
+            discard_staged(staged_path)
+        return JSONResponse({"error": "Server is shutting down"}, status_code=503)
+    
+    upload_log.info("Task %s queued with %d files", task_id, len(files_data))
     return JSONResponse({"task_id": task_id, "message": f"Upload started for {len(files_data)} files"})
 
 @app.get("/upload/status/{task_id}")
 async def upload_status(task_id: str):
-    """Get the status of an upload task with timeout detection"""
-    if task_id not in UPLOAD_STATUS:
+    """Get the status of an upload task (stuck tasks are failed by the upload watchdog)"""
+    status = task_store.get(task_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Upload task not found")
+    return JSONResponse(status)
+
+# Chunked upload sessions: the client declares its files, PUTs them in UPLOAD_CHUNK_SIZE pieces
+# (in any order and in parallel, each with a CRC32), retries only the pieces that failed, then
+# finalizes. Sessions are upload tasks in the "receiving" state, so they survive restarts too.
+# Handlers that need no request body are plain functions, so their file and store work runs on
+# the threadpool rather than the event loop.
+UPLOAD_SESSION_MAX_FILES = 500
+UPLOAD_SESSION_MAX_BYTES = int(os.getenv("UPLOAD_SESSION_MAX_MB", 2048)) * 1024 * 1024
+
+def chunk_count(size: int) -> int:
+    return (size + UPLOAD_CHUNK_SIZE - 1) // UPLOAD_CHUNK_SIZE
+
+def missing_chunks(task: dict, index: int) -> list[int]:
+    received = set(task["received"][index])
+    return [c for c in range(chunk_count(task["sizes"][index])) if c not in received]
+
+def receiving_session(task_id: str) -> dict | None:
+    """Payload of an upload session that still accepts chunks"""
+    status = task_store.get(task_id)
+    if status is None or status["status"] != task_store.RECEIVING:
+        return None
+    return task_store.payload(task_id)
+
+def write_chunk(path: str, offset: int, data: bytes, crc: int) -> bool:
+    """Write one chunk into its staged file; False (nothing written) if the checksum doesn't match"""
+    if zlib.crc32(data) != crc:
+        return False
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+    return True
+
+def record_chunk(task: dict, index: int, chunk: int) -> int:
+    received = task["received"][index]
+    if chunk not in received:
+        received.append(chunk)
+    return len(received)
+
+@app.post("/upload/sessions")
+def create_upload_session(body: dict = Body(...)):
+    """Start a chunked upload. Body: {"files": [{"name": ..., "size": ...}], "skip_duplicates": false}"""
+    try:
+        declared = [(os.path.basename(str(f["name"])), int(f["size"])) for f in body["files"]]
+    except Exception:
+        return JSONResponse({"error": 'Expected {"files": [{"name": ..., "size": ...}]}'}, status_code=400)
+    if not declared:
+        return JSONResponse({"error": "No files provided"}, status_code=400)
+    empty = [name for name, size in declared if size <= 0]
+    if empty:
+        return JSONResponse({"error": f"Empty files: {', '.join(empty)}"}, status_code=400)
+    if len(declared) > UPLOAD_SESSION_MAX_FILES:
+        return JSONResponse({"error": f"At most {UPLOAD_SESSION_MAX_FILES} files per upload"}, status_code=413)
+    if sum(size for _, size in declared) > UPLOAD_SESSION_MAX_BYTES:
+        return JSONResponse({"error": f"At most {UPLOAD_SESSION_MAX_BYTES // (1024 * 1024)} MB per upload"},
+                            status_code=413)
     
-    status = UPLOAD_STATUS[task_id].copy()
+    task_id = str(uuid.uuid4())
+    ensure_dirs(UPLOAD_STAGING_DIR)
+    files = []
+    for i, (name, size) in enumerate(declared):
+        staged_path = os.path.join(UPLOAD_STAGING_DIR, f"{task_id}-{i}")
+        # Sized up front so chunks can be written at their offsets in any order
+        with open(staged_path, "wb") as f:
+            f.truncate(size)
+        files.append([name, staged_path, None, None])
     
-    # Check for timeout (uploads taking longer than 10 minutes)
-    if status["status"] == "processing" and "started_at" in status:
-        elapsed = datetime.now() - status["started_at"]
-        last_activity_elapsed = datetime.now() - status.get("last_activity", status["started_at"])
-        
-        # Total timeout: 10 minutes
-        if elapsed.total_seconds() > 600:
-            UPLOAD_STATUS[task_id]["status"] = "error"
-            UPLOAD_STATUS[task_id]["errors"].append("Upload timeout: Process took longer than 10 minutes")
-            UPLOAD_STATUS[task_id]["current_file"] = None
-            print(f"[UPLOAD] Task {task_id} timed out after {elapsed.total_seconds():.1f} seconds")
-            status = UPLOAD_STATUS[task_id].copy()
-        # Activity timeout: no progress for 2 minutes
-        elif last_activity_elapsed.total_seconds() > 120:
-            UPLOAD_STATUS[task_id]["status"] = "error"
-            UPLOAD_STATUS[task_id]["errors"].append("Upload stuck: No activity for more than 2 minutes")
-            UPLOAD_STATUS[task_id]["current_file"] = None
-            print(f"[UPLOAD] Task {task_id} stuck - no activity for {last_activity_elapsed.total_seconds():.1f} seconds")
-            status = UPLOAD_STATUS[task_id].copy()
-    
-    # Clean up completed tasks older than 5 minutes
-    if status["status"] in ["completed", "error"]:
-        # You could add cleanup logic here if needed
-        pass
+    task_store.create(task_id, {
+        "status": task_store.RECEIVING,
+        "progress": 0,
+        "total": len(files),
+        "uploaded": 0,
+        "errors": [],
+        "duplicates": [],
+        "current_file": None
+    }, {
+        "files": files,
+        "sizes": [size for _, size in declared],
+        "received": [[] for _ in files],
+        "done": [],
+        "title": "",
+        "description": "",
+        # Opt-in, as with the multipart /upload form
+        "skip_duplicates": bool(body.get("skip_duplicates", False)),
+        "job": None
+    })
+    # The watchdog also expires sessions the client abandons
+    schedule_upload_watchdog()
+    upload_log.info("Session %s opened for %d files (%d bytes)", task_id, len(files), sum(s for _, s in declared))
+    return JSONResponse({
+        "task_id": task_id,
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "files": [{"index": i, "name": name, "size": size, "chunks": chunk_count(size)}
+                  for i, (name, size) in enumerate(declared)]
+    })
+
+@app.put("/upload/sessions/{task_id}/files/{index}/chunks/{chunk}")
+async def put_upload_chunk(task_id: str, index: int, chunk: int, request: Request):
+    """Store one chunk; the X-Chunk-CRC32 header (hex) must match or nothing is written (422, resend)"""
+    task = receiving_session(task_id)
+    if task is None:
+        return JSONResponse({"error": "Upload session not found or already finalized"}, status_code=404)
+    if not 0 <= index < len(task["files"]) or not 0 <= chunk < chunk_count(task["sizes"][index]):
+        return JSONResponse({"error": "No such chunk in this session"}, status_code=404)
+    try:
+        crc = int(request.headers.get("x-chunk-crc32", ""), 16)
+    except ValueError:
+        return JSONResponse({"error": "X-Chunk-CRC32 header (hex) is required"}, status_code=400)
     
-    # Remove internal timestamps from response
-    if "started_at" in status:
-        del status["started_at"]
-    if "last_activity" in status:
-        del status["last_activity"]
+    expected = min(UPLOAD_CHUNK_SIZE, task["sizes"][index] - chunk * UPLOAD_CHUNK_SIZE)
+    if int(request.headers.get("content-length") or 0) > expected:
+        return JSONResponse({"error": f"Chunk is larger than {expected} bytes"}, status_code=413)
+    data = await request.body()
+    if len(data) != expected:
+        return JSONResponse({"error": f"Chunk must be {expected} bytes, got {len(data)}"}, status_code=400)
     
-    return JSONResponse(status)
+    try:
+        if not await jobs.offload(write_chunk, task["files"][index][1], chunk * UPLOAD_CHUNK_SIZE, data, crc):
+            return JSONResponse({"error": "Checksum mismatch, resend the chunk"}, status_code=422)
+    except OSError as e:
+        upload_log.error("Failed to write chunk %d of file %d in session %s: %s", chunk, index, task_id, e)
+        return JSONResponse({"error": f"Failed to store chunk: {e}"}, status_code=500)
+    received = await jobs.offload(task_store.edit_payload, task_id, lambda t: record_chunk(t, index, chunk))
+    return JSONResponse({"received": received, "chunks": chunk_count(task["sizes"][index])})
+
+@app.get("/upload/sessions/{task_id}")
+def upload_session_status(task_id: str):
+    """Session status plus, while receiving, the chunks of each file still missing"""
+    status = task_store.get(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    task = task_store.payload(task_id)
+    files = []
+    if status["status"] == task_store.RECEIVING:
+        files = [{"index": i, "name": f[0], "size": task["sizes"][i], "chunks": chunk_count(task["sizes"][i]),
+                  "missing": missing_chunks(task, i)} for i, f in enumerate(task["files"])]
+    return JSONResponse({"task_id": task_id, **status, "chunk_size": UPLOAD_CHUNK_SIZE, "files": files})
+
+@app.post("/upload/sessions/{task_id}/finalize")
+def finalize_upload_session(task_id: str):
+    """Queue a fully received session for processing; 409 lists the chunks still missing"""
+    task = receiving_session(task_id)
+    if task is None:
+        return JSONResponse({"error": "Upload session not found or already finalized"}, status_code=404)
+    missing = {str(i): m for i in range(len(task["files"])) if (m := missing_chunks(task, i))}
+    if missing:
+        return JSONResponse({"error": "Chunks missing", "missing": missing}, status_code=409)
+    
+    if not task_store.transition(task_id, task_store.RECEIVING, "queued"):
+        return JSONResponse({"error": "Upload session already finalized"}, status_code=409)
+    if not queue_upload(task_id):
+        task_store.transition(task_id, "queued", task_store.RECEIVING)
+        return JSONResponse({"error": "Server is shutting down"}, status_code=503)
+    
+    upload_log.info("Task %s queued with %d files", task_id, len(task["files"]))
+    publish_upload_status(task_id)
+    return JSONResponse({"task_id": task_id, "message": f"Upload started for {len(task['files'])} files"})
+
+# Seconds between SSE keep-alive comments, also bounds how long a dead client lingers
+EVENTS_KEEPALIVE_SECONDS = 15
+
+@app.get("/events")
+async def event_stream(request: Request, topics: str = ""):
+    """
+    Server-sent events: `frame` when the displayed image changes and `upload` on upload progress.
+    `topics` is an optional comma separated filter, e.g. ?topics=frame
+    """
+    wanted = [t for t in topics.split(",") if t]
+    q = events.subscribe(wanted)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if not wanted or "frame" in wanted:
+                # Let a freshly opened page know which frame is current
+                yield events.format_sse("frame", {"version": frame_version(), "image_id": None})
+            while True:
+                try:
+                    message = await asyncio.wait_for(q.get(), timeout=EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield message
+        finally:
+            events.unsubscribe(q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Add a simple test endpoint to see if we can receive any POST data
 @app.post("/upload-test")
 async def upload_test(request: Request):
-    print("Upload test endpoint called")
     form = await request.form()
-    print(f"Form data: {dict(form)}")
+    upload_log.debug("Upload test endpoint called, form data: %s", dict(form))
     return {"received": "ok"}
 
 @app.post("/image/{id}/toggle")
@@ -541,6 +977,10 @@ def toggle_enable(id: int, db: Session = Depends(get_db)):
     if not img: return JSONResponse({"error":"not found"}, status_code=404)
     img.enabled = not img.enabled
     db.commit()
+    if img.enabled:
+        play_queue.add(img.id, shown=img.last_shown_at is not None)
+    else:
+        play_queue.remove(img.id)
     return {"enabled": img.enabled}
 
 @app.post("/image/{id}/update")
@@ -557,29 +997,34 @@ def update_image(id: int,
     img = db.get(Image, id)
     if not img: return JSONResponse({"error":"not found"}, status_code=404)
     img.title = title; img.description = description
-    if sort_order is not None: img.sort_order = sort_order
+    if sort_order is not None and sort_order != img.sort_order:
+        img.sort_order = sort_order
+        play_queue.invalidate()  # custom order breaks ties by sort_order
     if crop_x is not None: img.crop_x = crop_x
     if crop_y is not None: img.crop_y = crop_y
     if crop_width is not None: img.crop_width = crop_width
     if crop_height is not None: img.crop_height = crop_height
     img.preserve_aspect_ratio = preserve_aspect_ratio
-    db.commit(); return {"ok": True}
+    db.commit()
+    render_cache.invalidate(img.filename)
+    return {"ok": True}
 
 @app.post("/image/{id}/delete")
 def delete_image(id: int, db: Session = Depends(get_db)):
-    s = db.query(Settings).first()
+    s = settings_cache.get(db)
     img = db.get(Image, id)
     if not img: return JSONResponse({"error":"not found"}, status_code=404)
     # remove files
-    for root in (s.image_root, s.thumb_root):
-        p = os.path.join(root, img.filename)
+    for p in [os.path.join(s.image_root, img.filename)] + thumbnail_paths(s.thumb_root, img.filename):
         if os.path.exists(p): os.remove(p)
+    render_cache.invalidate(img.filename)
+    play_queue.remove(img.id)
     db.delete(img); db.commit()
     return {"ok": True}
 
 @app.get("/settings")
 def settings_page(request: Request, db: Session = Depends(get_db)):
-    s = db.query(Settings).first()
+    s = settings_cache.get(db)
     if not s:
         raise HTTPException(500, "Settings row missing")
 
@@ -633,7 +1078,9 @@ def settings_page(request: Request, db: Session = Depends(get_db)):
         "request": request,
         "settings": s,
         "dev_mode": is_dev_mode(),
-        "hardware": hardware
+        "hardware": hardware,
+        "dither_modes": DITHER_MODES,
+        "panel_palette": eframe_inky.get_panel_palette(),
     })
 
 # app.py – REPLACE the existing /settings handler with this:
@@ -646,15 +1093,22 @@ def update_settings(
     thumb_root: str = Form(...),
     resolution: str = Form(...),  # e.g. "800,480"
     border_color: str = Form(None),
+    dither_mode: str = Form(None),
     db: Session = Depends(get_db)
 ):
     s = db.query(Settings).first()
+    # Cached frames are only valid for the resolution and source directory they were rendered from
+    resolution_changed = s.resolution != resolution.strip()
+    frames_stale = resolution_changed or s.image_root != image_root.strip()
     s.interval_ms = interval_ms
     s.order_mode = order_mode
     s.slideshow_enabled = bool(slideshow_enabled)
     s.image_root = image_root.strip()
     s.thumb_root = thumb_root.strip()
     s.resolution = resolution.strip()
+    if dither_mode in DITHER_MODES:
+        # Dithered frames are cached per mode, so switching needs no invalidation
+        s.dither_mode = dither_mode
 
     # Set border color if hardware is detected and value provided
     if border_color:
@@ -663,135 +1117,336 @@ def update_settings(
             if inky and hasattr(inky, "set_border"):
                 inky.set_border(border_color)
         except Exception as e:
-            print(f"[SETTINGS] Failed to set Inky border color: {e}")
+            log.warning("Failed to set Inky border color: %s", e)
 
     # Make sure folders exist after edits
-    ensure_dirs(s.image_root, s.thumb_root, os.path.dirname("static/current.jpg"))
+    ensure_dirs(s.image_root, s.thumb_root, os.path.dirname(frame_store.CURRENT_FRAME))
 
     db.commit()
+    # Subscribers (e.g. the slideshow timer) react to the new values right away
+    settings_cache.invalidate()
+    if frames_stale:
+        render_cache.clear()
+    if resolution_changed:
+        # Existing crops were shaped for the old aspect ratio
+        start_recrop_job("resolution")
     return RedirectResponse("/settings", status_code=303)
 
+def crop_source(thumb_root: str, filename: str, thumb_formats: str | None) -> str:
+    """Smallest thumbnail of an image, which is all the crop engine needs to look at"""
+    if thumb_formats:
+        return thumb_path(thumb_root, filename, THUMB_SIZES[0], "jpeg")
+    return os.path.join(thumb_root, filename)  # legacy single thumbnail
+
+# Background crop recalculation: one job at a time, a newer request supersedes the running one
+RECROP_JOB: Dict[str, Any] = {"job": None, "status": {"status": "idle"}}
+RECROP_LOCK = threading.Lock()
+RECROP_CHUNK_SIZE = 100
+
+def start_recrop_job(mode: str) -> dict:
+    """
+    Recalculate crops in the background. `mode` is "defaults" (only images still on a
+    full-frame crop) or "resolution" (every image, after the display aspect ratio changed).
+    """
+    with RECROP_LOCK:
+        # The superseded run stops before its next chunk; the "recrop" kind runs one job at a
+        # time, so this one only starts writing crops once that has happened
+        jobs.cancel(RECROP_JOB["job"])
+        status = {"status": "queued", "mode": mode, "processed": 0, "total": 0,
+                  "updated": 0, "started_at": datetime.now().isoformat(), "finished_at": None}
+        RECROP_JOB["status"] = status
+        job = jobs.submit("recrop", recrop_job, mode, status, priority=jobs.PRIORITY_LOW)
+        RECROP_JOB["job"] = job["id"] if job else None
+        return dict(status)
+
+def recrop_chunk(rows, s: Settings, mode: str) -> list[dict]:
+    """New crops for one chunk of (id, filename, width, height, thumb_formats, crop...) rows, as update dicts"""
+    full_frame, edited = [], []
+    for r in rows:
+        if (r.crop_x, r.crop_y, r.crop_width, r.crop_height) == (0, 0, 100, 100):
+            full_frame.append(r)
+        elif mode == "resolution":
+            edited.append(r)
+    
+    new_crops = {}
+    # Untouched images get a fresh saliency default, exactly like a new upload
+    crop_jobs = [(r.id, crop_source(s.thumb_root, r.filename, r.thumb_formats), r.width, r.height) for r in full_frame]
+    # One pool worker per chunk, matching the single CPU slot the recrop job holds
+    new_crops.update(batch_saliency_crops(crop_jobs, s.resolution, UPLOAD_POOL["executor"],
+                                          chunk_size=max(1, len(crop_jobs))))
+    # Hand-edited crops keep their centre and size, reshaped to the new aspect ratio in one vectorized pass
+    if edited:
+        refitted = refit_crops([r.width for r in edited], [r.height for r in edited],
+                               [(r.crop_x, r.crop_y, r.crop_width, r.crop_height) for r in edited], s.resolution)
+        new_crops.update((r.id, tuple(float(v) for v in crop)) for r, crop in zip(edited, refitted))
+    
+    by_id = {r.id: r for r in rows}
+    return [
+        {"id": image_id, "crop_x": crop[0], "crop_y": crop[1], "crop_width": crop[2], "crop_height": crop[3]}
+        for image_id, crop in new_crops.items()
+        if tuple(crop) != (by_id[image_id].crop_x, by_id[image_id].crop_y,
+                           by_id[image_id].crop_width, by_id[image_id].crop_height)
+    ]
+
+def recrop_job(mode: str, status: dict, last_id: int = 0):
+    """
+    Recalculate one chunk of crops, then queue the next chunk as a new job, so renders and
+    slideshow slots get the CPU between chunks
+    """
+    try:
+        with SessionLocal() as db:
+            s = settings_cache.get(db)
+            if not s or not s.resolution:
+                raise ValueError("No display resolution configured")
+            
+            q = db.query(Image.id, Image.filename, Image.width, Image.height, Image.thumb_formats,
+                         Image.crop_x, Image.crop_y, Image.crop_width, Image.crop_height
+                         ).filter(Image.width > 0, Image.height > 0)
+            if mode == "defaults":
+                q = q.filter(Image.crop_x == 0, Image.crop_y == 0, Image.crop_width == 100, Image.crop_height == 100)
+            if last_id == 0:
+                status.update(status="running", total=q.count(), resolution=s.resolution)
+                events.publish("recrop", status)
+            
+            # Keyset chunks of plain tuples; rows updated by earlier chunks are never revisited
+            rows = q.filter(Image.id > last_id).order_by(Image.id).limit(RECROP_CHUNK_SIZE).all()
+            if rows:
+                updates = recrop_chunk(rows, s, mode)
+                if updates:
+                    # executemany UPDATE by primary key, committed per chunk so progress survives a restart
+                    db.execute(update(Image), updates)
+                    db.commit()
+                status["processed"] += len(rows)
+                status["updated"] += len(updates)
+                
+                with RECROP_LOCK:
+                    # A newer run replaced this one (and cancelled it) while the chunk was written
+                    if RECROP_JOB["status"] is not status or jobs.cancelled():
+                        status.update(status="cancelled", finished_at=datetime.now().isoformat())
+                        return
+                    job = jobs.submit("recrop", recrop_job, mode, status, rows[-1].id, priority=jobs.PRIORITY_LOW)
+                    RECROP_JOB["job"] = job["id"] if job else None
+                if job is None:
+                    status.update(status="cancelled", finished_at=datetime.now().isoformat())
+                return
+            
+            status.update(status="completed", finished_at=datetime.now().isoformat())
+            crops_log.info("Recalculated %d of %d crops (%s)", status["updated"], status["total"], mode)
+    except Exception as e:
+        crops_log.error("Recalculation failed: %s", e)
+        status.update(status="error", error=str(e), finished_at=datetime.now().isoformat())
+    finally:
+        events.publish("recrop", status)
+
 @app.post("/recalculate-crops")
 def recalculate_crops(db: Session = Depends(get_db)):
     """
     Recalculate smart crop defaults for existing images that use full-frame crops.
     Useful for applying smart defaults to images uploaded before this feature.
+    Runs in the background; poll /recalculate-crops/status (or listen for `recrop` events).
     """
-    s = db.query(Settings).first()
+    s = settings_cache.get(db)
     if not s or not s.resolution:
         return JSONResponse({"error": "No display resolution configured"}, status_code=400)
-    
-    # Find images that are using default full-frame crop (likely uploaded before smart crops)
-    images = db.query(Image).filter(
-        Image.crop_x == 0,
-        Image.crop_y == 0, 
-        Image.crop_width == 100,
-        Image.crop_height == 100
-    ).all()
-    
-    updated_count = 0
-    for img in images:
-        if img.width and img.height:
-            crop_x, crop_y, crop_width, crop_height = calculate_smart_crop(
-                img.width, img.height, s.resolution
-            )
-            
-            # Only update if the smart crop is different from current (not already perfect aspect ratio)
-            if not (crop_x == 0 and crop_y == 0 and crop_width == 100 and crop_height == 100):
-                img.crop_x = crop_x
-                img.crop_y = crop_y
-                img.crop_width = crop_width
-                img.crop_height = crop_height
-                updated_count += 1
-    
-    db.commit()
-    return {"updated_count": updated_count, "total_checked": len(images)}
+    return JSONResponse(start_recrop_job("defaults"), status_code=202)
+
+@app.get("/recalculate-crops/status")
+def recalculate_crops_status():
+    return RECROP_JOB["status"]
 
 @app.post("/show-now/{id}")
 def show_now(id: int, db: Session = Depends(get_db)):
-    s = db.query(Settings).first()
+    """
+    Render and display an image in the background. Answers 202 with a job id at once;
+    poll /jobs/{job_id} for the frame version (or listen for the `frame` event).
+    """
     img = db.get(Image, id)
     if not img: return JSONResponse({"error":"not found"}, status_code=404)
     
-    src = os.path.join(s.image_root, img.filename)
-    render_to_output(src, "static/current.jpg", s.resolution, 
-                    img.crop_x or 0, img.crop_y or 0, 
-                    img.crop_width or 100, img.crop_height or 100,
-                    img.preserve_aspect_ratio or False)
-    
-    # Queue the display update (non-blocking)
-    queue_display("static/current.jpg", img.id)
-    
-    # Return immediately - display will happen in background
-    return {"ok": True, "queued": True}
+    job = jobs.submit("render", show_now_job, img.id, priority=jobs.PRIORITY_HIGH)
+    if job is None:
+        return JSONResponse({"error": "Too many renders in progress, try again shortly"},
+                            status_code=503, headers={"Retry-After": "5"})
+    return JSONResponse({"ok": True, "job_id": job["id"], "status": job["status"]}, status_code=202)
 
-def pick_next(db: Session, s: Settings) -> Image | None:
-    q = db.query(Image).filter(Image.enabled == True)
+def show_now_job(image_id: int) -> dict:
+    with SessionLocal() as db:
+        s = settings_cache.get(db)
+        img = db.get(Image, image_id)
+        if not img:
+            raise ValueError(f"Image {image_id} no longer exists")
+        
+        frame = render_current(img, s)
+        if frame is None:
+            # A later show-now took over while this one waited to render
+            return {"queued": False, "superseded": True, "version": frame_version()}
+        
+        # Queue the display update (non-blocking); display_job records the image as played once shown
+        queued = queue_display(frame, img.id)
+        return {"queued": queued, "version": frame["version"]}
 
-    if s.order_mode == "random":
-        imgs = q.all()
-        return random.choice(imgs) if imgs else None
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    return job
 
-    # Prefer images never shown, then least-recently shown.
-    never_shown_first = case((Image.last_shown_at.is_(None), 0), else_=1)
+def load_panel_frame(img: Image, s: Settings):
+    """Rendered frame and its dithered panel version for an image, computed once and cached"""
+    return render_cache.load_panel_frame(os.path.join(s.image_root, img.filename), s.resolution,
+                                         img.crop_x or 0, img.crop_y or 0,
+                                         img.crop_width or 100, img.crop_height or 100,
+                                         img.preserve_aspect_ratio or False,
+                                         palette=eframe_inky.get_panel_palette(),
+                                         dither_mode=s.dither_mode or DEFAULT_DITHER_MODE)
 
+def render_current(img: Image, s: Settings, priority: int = display_queue.PRIORITY_MANUAL) -> dict | None:
+    """
+    Render an image and publish it as the current frame, reusing cached frames when available.
+    Returns the published frame, or None if a newer (or more important) request superseded this one.
+    """
+    def render():
+        framed, panel, hit = load_panel_frame(img, s)
+        render_log.debug("%s: %s", img.filename, "cache hit" if hit else "rendered")
+        return framed, panel
+
+    frame = frame_store.publish(render, priority)
+    if frame is None:
+        render_log.info("%s: superseded by a newer request", img.filename)
+    return frame
+
+def prerender(img: Image, s: Settings):
+    """Render and dither an image into the frame cache without publishing it"""
+    _, _, hit = load_panel_frame(img, s)
+    slideshow_log.debug("Prepared next image %s: %s", img.filename, "cache hit" if hit else "rendered")
+
+def load_play_queue(db: Session, s: Settings):
+    """Build the slideshow play queue with one ordered query over enabled image ids"""
+    # Prefer images never shown, then least-recently shown: SQLite sorts NULLs first, so
+    # ordering on last_shown_at alone does both and ix_images_enabled_last_shown serves it.
     if s.order_mode == "custom":
         # honor custom sort first when tie-breaking
-        return (
-            q.order_by(
-                never_shown_first.asc(),
-                Image.last_shown_at.asc(),
-                Image.sort_order.asc(),
-                Image.created_at.asc(),
-            )
-            .first()
-        )
-    else:  # "added"
+        tie_break = (Image.sort_order.asc(), Image.created_at.asc())
+    else:  # "added" (random ignores the order)
         # show by added time when tie-breaking
-        return (
-            q.order_by(
-                never_shown_first.asc(),
-                Image.last_shown_at.asc(),
-                Image.created_at.asc(),
-                Image.sort_order.asc(),
-            )
-            .first()
-        )
-
-def slideshow_loop():
-    while not SLIDESHOW_THREAD["stop"]:
-        interval_seconds = 600  # default fallback
-        try:
-            with SessionLocal() as db:
-                s = db.query(Settings).first()
-                if s:
-                    # compute the sleep interval while session is open
-                    interval_seconds = max(5, int(s.interval_ms) / 1000)
-                if s and s.slideshow_enabled:
-                    img = pick_next(db, s)
-                    if img:
-                        render_to_output(os.path.join(s.image_root, img.filename),
-                                         "static/current.jpg", s.resolution,
-                                         img.crop_x or 0, img.crop_y or 0, 
-                                         img.crop_width or 100, img.crop_height or 100,
-                                         img.preserve_aspect_ratio or False)
-                        
-                        # Queue the display update (non-blocking)
-                        queue_display("static/current.jpg", img.id)
-                        
-        except Exception as e:
-            print("Slideshow error:", e)
-            interval_seconds = 10  # back off briefly on error
+        tie_break = (Image.created_at.asc(), Image.sort_order.asc())
+    rows = (
+        db.query(Image.id, Image.last_shown_at)
+        .filter(Image.enabled == True)
+        .order_by(Image.last_shown_at.asc(), *tie_break, Image.id.asc())
+        .all()
+    )
+    play_queue.load(s.order_mode,
+                    [image_id for image_id, shown in rows if shown is None],
+                    [image_id for image_id, shown in rows if shown is not None])
+    slideshow_log.info("Play queue built: %d images (%s)", len(rows), s.order_mode)
+
+def pick_next(db: Session, s: Settings) -> Image | None:
+    """Next image in the play queue; O(1) apart from the occasional rebuild"""
+    if not play_queue.is_loaded(s.order_mode):
+        load_play_queue(db, s)
+    image_id = play_queue.peek()
+    while image_id is not None:
+        img = db.get(Image, image_id)
+        if img and img.enabled:
+            return img
+        play_queue.remove(image_id)  # changed outside the app, e.g. by a maintenance script
+        image_id = play_queue.peek()
+    return None
+
+def take_prepared(db: Session, s: Settings) -> Image | None:
+    """Return the image chosen by the previous look-ahead if still eligible, else pick now"""
+    next_id = SLIDESHOW["next_id"]
+    SLIDESHOW["next_id"] = None
+    if next_id is not None:
+        img = db.get(Image, next_id)
+        if img and img.enabled:
+            return img
+    return pick_next(db, s)
+
+def prepare_next(db: Session, s: Settings):
+    """Decide the following slideshow image now and render it while the slot is idle"""
+    try:
+        nxt = pick_next(db, s)
+        if nxt:
+            prerender(nxt, s)
+            SLIDESHOW["next_id"] = nxt.id
+    except Exception as e:
+        slideshow_log.warning("Look-ahead failed: %s", e)
+        SLIDESHOW["next_id"] = None
+
+def prepare_next_job():
+    with SessionLocal() as db:
+        s = settings_cache.get(db)
+        if s and s.slideshow_enabled:
+            prepare_next(db, s)
+
+def slideshow_interval(s: Settings | None) -> float:
+    return max(5, int(s.interval_ms) / 1000) if s else 600  # default fallback
+
+def schedule_slideshow(interval_seconds: float | None = None):
+    """
+    Plan the next slideshow slot, replacing any slot already planned. Slots keep to a fixed
+    timeline counted from the last one, so render time doesn't push later slots back.
+    """
+    with SLIDESHOW_LOCK:
+        if interval_seconds is None:
+            interval_seconds = slideshow_interval(settings_cache.get())
+        now = time.monotonic()
+        # Never try to catch up on missed slots (e.g. after a long render or clock jump)
+        next_slot = now if SLIDESHOW["slot"] is None else max(SLIDESHOW["slot"] + interval_seconds, now)
+        # Called from inside a slot, the planned job is the running one: let it finish as done
+        if SLIDESHOW["job"] != jobs.current_id():
+            jobs.cancel(SLIDESHOW["job"])
+        job = jobs.submit("slideshow", slideshow_slot, next_slot, delay=next_slot - now)
+        SLIDESHOW["job"] = job["id"] if job else None
 
-        time.sleep(interval_seconds)
+def slideshow_slot(slot: float):
+    """One slideshow slot: show the prepared image and plan the next slot"""
+    SLIDESHOW["slot"] = slot
+    interval_seconds = 600  # default fallback
+    try:
+        with SessionLocal() as db:
+            s = settings_cache.get(db)
+            interval_seconds = slideshow_interval(s)
+            if s and s.slideshow_enabled and display_queue.has_pending(display_queue.PRIORITY_MANUAL):
+                # A manual "show now" is still waiting for the panel; let it have this slot
+                slideshow_log.debug("Skipping slot, manual display pending")
+            elif s and s.slideshow_enabled:
+                img = take_prepared(db, s)
+                if img:
+                    # Normally a cache hit: the look-ahead rendered this frame during the last interval
+                    # A "show now" rendering at the same time wins; this slot is then skipped
+                    frame = render_current(img, s, display_queue.PRIORITY_SLIDESHOW)
+                    
+                    # Queue the display update (non-blocking); display_job records the image as played
+                    # and starts the next look-ahead, so a frame that is never shown keeps its place
+                    if frame:
+                        queue_display(frame, img.id, display_queue.PRIORITY_SLIDESHOW)
+                    
+    except Exception as e:
+        slideshow_log.exception("Slideshow error: %s", e)
+        interval_seconds = 10  # back off briefly on error
+    
+    # A settings change may already have re-planned (and cancelled) this slot
+    if not jobs.cancelled():
+        schedule_slideshow(interval_seconds)
 
+def wake_slideshow():
+    """Settings changed: re-plan the next slot from the new interval instead of finishing the old wait"""
+    schedule_slideshow()
 
 def start_slideshow():
-    if SLIDESHOW_THREAD["t"] and SLIDESHOW_THREAD["t"].is_alive():
-        return
-    SLIDESHOW_THREAD["stop"] = False
-    SLIDESHOW_THREAD["t"] = threading.Thread(target=slideshow_loop, daemon=True)
-    SLIDESHOW_THREAD["t"].start()
+    settings_cache.subscribe(wake_slideshow)
+    SLIDESHOW["slot"] = None
+    schedule_slideshow()
+
+def stop_slideshow():
+    settings_cache.unsubscribe(wake_slideshow)
+    with SLIDESHOW_LOCK:
+        jobs.cancel(SLIDESHOW["job"])
+        SLIDESHOW["job"] = None
 
 if __name__ == "__main__":
     import uvicorn
@@ -813,9 +1468,10 @@ if __name__ == "__main__":
     if use_reload:
         print("INFO:     Development mode - auto-reload enabled")
         # For reload to work, we need to pass the app as an import string
-        uvicorn.run("app:app", host="0.0.0.0", port=8080, reload=True)
+        uvicorn.run("app:app", host="0.0.0.0", port=8080, reload=True, timeout_graceful_shutdown=5)
     else:
         print("INFO:     Production mode - auto-reload disabled")
         # In production, we can pass the app object directly
-        uvicorn.run(app, host="0.0.0.0", port=8080, reload=False)
+        # Open event streams never finish on their own; don't let them block shutdown
+        uvicorn.run(app, host="0.0.0.0", port=8080, reload=False, timeout_graceful_shutdown=5)
 
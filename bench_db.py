@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark the library queries against synthetic image tables, with and without the
+indexes declared in models.py.
+
+    python bench_db.py                 # 10k and 100k rows
+    python bench_db.py 250000          # custom sizes
+
+Builds throwaway databases in a temporary directory; photo_frame.db is never touched.
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from database import SQLITE_PRAGMAS
+from models import Base, Image
+
+PAGE_SIZE = 24   # app.GALLERY_PAGE_SIZE
+CHUNK_SIZE = 100  # app.RECROP_CHUNK_SIZE
+REPEATS = 5
+
+QUERIES = {
+    "gallery first page": (
+        "SELECT id FROM images ORDER BY sort_order, created_at, id LIMIT ?",
+        lambda n: (PAGE_SIZE + 1,),
+    ),
+    "gallery deep page": (
+        "SELECT id FROM images WHERE (sort_order, coalesce(created_at, ''), id) > (?, '', 0) "
+        "ORDER BY sort_order, created_at, id LIMIT ?",
+        lambda n: (n - 100, PAGE_SIZE + 1),
+    ),
+    "play queue load": (
+        "SELECT id, last_shown_at FROM images WHERE enabled = 1 "
+        "ORDER BY last_shown_at, created_at, sort_order, id",
+        lambda n: (),
+    ),
+    "default crops count": (
+        "SELECT count(*) FROM images WHERE width > 0 AND height > 0 "
+        "AND crop_x = 0 AND crop_y = 0 AND crop_width = 100 AND crop_height = 100",
+        lambda n: (),
+    ),
+    "default crops chunk": (
+        "SELECT id FROM images WHERE width > 0 AND height > 0 "
+        "AND crop_x = 0 AND crop_y = 0 AND crop_width = 100 AND crop_height = 100 "
+        "AND id > ? ORDER BY id LIMIT ?",
+        lambda n: (n // 2, CHUNK_SIZE),
+    ),
+    "next sort order": (
+        "SELECT coalesce(max(sort_order), 0) FROM images",
+        lambda n: (),
+    ),
+    "filename lookup": (
+        "SELECT id FROM images WHERE filename = ?",
+        lambda n: (f"img_{n // 2:07d}.jpg",),
+    ),
+}
+
+
+def build(path: str, rows: int):
+    """Create the schema from models.py and fill it with a plausible library"""
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    rng = random.Random(rows)
+    start = datetime(2020, 1, 1)
+    conn = sqlite3.connect(path)
+    data = []
+    for i in range(rows):
+        created = start + timedelta(minutes=i)
+        shown = created + timedelta(days=rng.randint(1, 400)) if rng.random() < 0.7 else None
+        default_crop = rng.random() < 0.5
+        data.append((
+            f"img_{i:07d}.jpg", f"photo {i}.jpg", 4000, 3000, rng.random() < 0.9, i + 1,
+            rng.randint(0, 50), shown, created,
+            0.0 if default_crop else 5.0, 0.0 if default_crop else 12.5,
+            100.0 if default_crop else 90.0, 100.0 if default_crop else 75.0,
+        ))
+    conn.executemany(
+        "INSERT INTO images (filename, original_name, width, height, enabled, sort_order, "
+        "times_shown, last_shown_at, created_at, crop_x, crop_y, crop_width, crop_height) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", data)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    for name, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def run(conn: sqlite3.Connection, rows: int) -> dict:
+    results = {}
+    for label, (sql, params) in QUERIES.items():
+        args = params(rows)
+        conn.execute(sql, args).fetchall()  # warm the page cache
+        best = float("inf")
+        for _ in range(REPEATS):
+            t0 = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            best = min(best, time.perf_counter() - t0)
+        results[label] = best * 1000
+    return results
+
+
+def bench(rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        t0 = time.perf_counter()
+        build(path, rows)
+        print(f"\n{rows:,} rows (built in {time.perf_counter() - t0:.1f}s)")
+
+        conn = connect(path)
+        indexed = run(conn, rows)
+        for index in Image.__table__.indexes:
+            if index.name != "ix_images_content_hash":
+                conn.execute(f"DROP INDEX {index.name}")
+        bare = run(conn, rows)
+        conn.close()
+
+        print(f"{'query':<22}{'no index':>12}{'indexed':>12}{'speed-up':>10}")
+        for label in QUERIES:
+            speedup = bare[label] / indexed[label] if indexed[label] else float("inf")
+            print(f"{label:<22}{bare[label]:>10.2f}ms{indexed[label]:>10.2f}ms{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+    for size in sizes:
+        bench(size)
@@ -9,6 +9,7 @@ import os
 import shutil
 from database import SessionLocal
 from models import Image, Settings
+from utils import render_cache
 
 def count_files_in_directory(directory):
     """Count files in a directory"""
@@ -100,13 +101,15 @@ def cleanup_images():
             except Exception as e:
                 print(f"⚠️  Error removing upload files: {e}")
         
-        # Remove thumbnail files
-        if thumbs_count > 0 and os.path.exists(settings.thumb_root):
+        # Remove thumbnail files (including the size directories of the thumbnail pyramid)
+        if os.path.exists(settings.thumb_root):
             try:
                 for filename in os.listdir(settings.thumb_root):
                     file_path = os.path.join(settings.thumb_root, filename)
                     if os.path.isfile(file_path):
                         os.remove(file_path)
+                    elif os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
                 print(f"✅ Removed {thumbs_count} thumbnail files")
             except Exception as e:
                 print(f"⚠️  Error removing thumbnail files: {e}")
@@ -119,6 +122,10 @@ def cleanup_images():
             except Exception as e:
                 print(f"⚠️  Error removing current display image: {e}")
         
+        # Remove cached rendered frames
+        render_cache.clear()
+        print("✅ Cleared render cache")
+        
         print()
         print("🎉 Cleanup completed successfully!")
         print("   Your image frame is now ready for fresh content.")
@@ -1,9 +1,31 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import sessionmaker
 from models import Base
+import migrations
 
 engine = create_engine("sqlite:///photo_frame.db", connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Applied to every new connection. WAL lets the gallery read while the upload and slideshow
+# threads write; NORMAL sync is safe with WAL (a power cut can lose the last commit, never
+# corrupt the database) and avoids an fsync per commit on SD cards.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,    # KiB when negative: 16 MB page cache
+    "temp_store": "MEMORY",  # sorts and temporary indexes stay off the SD card
+    "busy_timeout": 5000,    # ms to wait for another connection's write lock
+}
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
 def init_db():
+    """Create missing tables and bring an existing database up to the current schema (see migrations.py)"""
+    fresh = not inspect(engine).has_table("images")
     Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine.url.database, fresh=fresh)
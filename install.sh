@@ -112,13 +112,6 @@ else
     echo "   ⚠️  migrate_db.py not found, skipping database setup"
 fi
 
-# Run additional migrations if they exist
-if [[ -f "migrate_aspect_ratio.py" ]]; then
-    echo "   Running additional migrations..."
-    python migrate_aspect_ratio.py
-    echo "   ✅ Migrations completed"
-fi
-
 # Create necessary directories
 echo "📁 Creating required directories..."
 python -c "
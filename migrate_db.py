@@ -1,46 +1,26 @@
 #!/usr/bin/env python3
 """
-Migration script to add crop columns to existing database
+Create photo_frame.db, or upgrade an existing one to the current schema, and run the
+data backfills (content hashes, thumbnails) to completion
+
+The app does the same on every start, with the backfills running in the background,
+so this is only needed during installation or to finish a large backfill up front.
 """
 
-import sqlite3
-import os
+from database import engine, init_db
+import migrations
+from utils import log
 
 def migrate_database():
-    db_path = "photo_frame.db"
-    
-    if not os.path.exists(db_path):
-        print("Database does not exist, no migration needed")
-        return
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    log.setup()
+    db_path = engine.url.database
+    init_db()
+    print(f"Schema version: {migrations.schema_version(db_path)}")
     
-    try:
-        # Check if crop_x column already exists
-        cursor.execute("PRAGMA table_info(images)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'crop_x' in columns:
-            print("Crop columns already exist, no migration needed")
-            return
-        
-        print("Adding crop columns to images table...")
-        
-        # Add the crop columns
-        cursor.execute("ALTER TABLE images ADD COLUMN crop_x INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE images ADD COLUMN crop_y INTEGER DEFAULT 0") 
-        cursor.execute("ALTER TABLE images ADD COLUMN crop_width INTEGER DEFAULT 100")
-        cursor.execute("ALTER TABLE images ADD COLUMN crop_height INTEGER DEFAULT 100")
-        
-        conn.commit()
-        print("Migration completed successfully!")
-        
-    except Exception as e:
-        print(f"Migration error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+    filled = migrations.run_backfills(db_path)
+    for name, count in filled.items():
+        print(f"Backfilled {name}: {count} images")
+    print("Migration completed successfully!")
 
 if __name__ == "__main__":
     migrate_database()
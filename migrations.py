@@ -0,0 +1,216 @@
+import os, sqlite3, time
+from PIL import Image as PILImage
+from utils.image_utils import file_hash, write_thumbnails
+from utils.log import get_logger
+
+# Versioned schema migrations for photo_frame.db, run by init_db() at startup.
+#
+# The schema version is stored in the database itself (PRAGMA user_version). Each step runs in
+# its own transaction together with its version bump, and checks before it alters, so databases
+# upgraded with the old one-off migrate_*.py scripts (which never recorded a version) are safe.
+# New steps are appended to MIGRATIONS; never renumber or edit a released step.
+#
+# Schema steps are quick. Work proportional to the library (hashing originals, generating
+# thumbnails) is a backfill instead: the app runs it after startup one small batch per
+# background job, and each batch holds the write lock only for one short UPDATE.
+
+log = get_logger("migrate")
+
+BACKFILL_BATCH_SIZE = 10
+BACKFILL_PAUSE = 0.05  # seconds between batches, so app writes get the lock in between
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # Autocommit mode so BEGIN/COMMIT are explicit and DDL is part of the step's transaction
+    return sqlite3.connect(db_path, isolation_level=None, timeout=30)
+
+
+def _columns(conn, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table: str, name: str, ddl: str):
+    if name not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+        log.info("Added %s.%s", table, name)
+
+
+def _crop_columns(conn):
+    _add_column(conn, "images", "crop_x", "FLOAT DEFAULT 0")
+    _add_column(conn, "images", "crop_y", "FLOAT DEFAULT 0")
+    _add_column(conn, "images", "crop_width", "FLOAT DEFAULT 100")
+    _add_column(conn, "images", "crop_height", "FLOAT DEFAULT 100")
+
+
+def _aspect_ratio(conn):
+    # Existing images keep crop-to-fill
+    _add_column(conn, "images", "preserve_aspect_ratio", "BOOLEAN DEFAULT FALSE")
+
+
+def _content_hash(conn):
+    _add_column(conn, "images", "content_hash", "VARCHAR(64)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_images_content_hash ON images (content_hash)")
+
+
+def _thumb_formats(conn):
+    _add_column(conn, "images", "thumb_formats", "VARCHAR DEFAULT ''")
+
+
+def _dither_mode(conn):
+    # Floyd-Steinberg is what the Inky driver applied before the setting existed
+    _add_column(conn, "settings", "dither_mode", "VARCHAR DEFAULT 'floyd-steinberg'")
+
+
+def _query_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_images_display_order ON images (sort_order, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_images_enabled_last_shown "
+                 "ON images (enabled, last_shown_at, created_at, sort_order)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_images_crop ON images (crop_width, crop_height, crop_x, crop_y)")
+    conn.execute("ANALYZE images")
+
+
+MIGRATIONS = [
+    (1, "crop columns", _crop_columns),
+    (2, "preserve_aspect_ratio", _aspect_ratio),
+    (3, "content_hash column and index", _content_hash),
+    (4, "thumb_formats column", _thumb_formats),
+    (5, "dither_mode setting", _dither_mode),
+    (6, "query indexes", _query_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db_path: str) -> int:
+    conn = _connect(db_path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def upgrade(db_path: str, fresh: bool = False) -> int:
+    """
+    Apply pending migrations. `fresh` means the tables were just created from the models,
+    which already match the latest schema, so the database is only stamped.
+    Returns the resulting schema version; raises if a step fails (that step is rolled back).
+    """
+    conn = _connect(db_path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if fresh:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            log.info("New database at schema version %d", SCHEMA_VERSION)
+            return SCHEMA_VERSION
+        if version > SCHEMA_VERSION:
+            log.warning("Database schema %d is newer than this code (%d)", version, SCHEMA_VERSION)
+            return version
+
+        for step_version, description, step in MIGRATIONS:
+            if step_version <= version:
+                continue
+            t0 = time.monotonic()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {step_version}")
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                log.error("Migration %d (%s) failed: %s", step_version, description, e)
+                raise
+            version = step_version
+            log.info("Applied %d: %s (%.2fs)", step_version, description, time.monotonic() - t0)
+        return version
+    finally:
+        conn.close()
+
+
+def _file_hash(path: str, thumb_root: str, filename: str) -> str:
+    return file_hash(path)
+
+
+def _thumbnails(path: str, thumb_root: str, filename: str) -> str:
+    with PILImage.open(path) as img:
+        return write_thumbnails(img, thumb_root, filename)
+
+
+# name -> (rows still missing the value, compute(original_path, thumb_root, filename), store)
+BACKFILLS = {
+    "content hashes": (
+        "SELECT id, filename FROM images WHERE content_hash IS NULL AND id > ? ORDER BY id LIMIT ?",
+        _file_hash,
+        "UPDATE images SET content_hash = ? WHERE id = ?",
+    ),
+    "thumbnails": (
+        "SELECT id, filename FROM images WHERE (thumb_formats IS NULL OR thumb_formats = '') "
+        "AND id > ? ORDER BY id LIMIT ?",
+        _thumbnails,
+        "UPDATE images SET thumb_formats = ? WHERE id = ?",
+    ),
+}
+
+
+def backfill_batch(db_path: str, position: tuple | None = None,
+                   batch_size: int = BACKFILL_BATCH_SIZE) -> tuple[tuple | None, str, int]:
+    """
+    Fill in one batch of data the schema steps couldn't. `position` is where the previous
+    batch stopped ((backfill name, last image id), None to start). Files are read outside any
+    transaction; the batch is then written in one short one. Rows whose original is missing
+    are skipped and picked up again on the next run.
+    Returns (position for the next batch or None when every backfill is done, backfill name, rows filled).
+    """
+    names = list(BACKFILLS)
+    name, last_id = position or (names[0], 0)
+    conn = _connect(db_path)
+    try:
+        row = conn.execute("SELECT image_root, thumb_root FROM settings LIMIT 1").fetchone()
+        image_root, thumb_root = row if row else ("static/uploads", "static/thumbs")
+
+        select_sql, compute, update_sql = BACKFILLS[name]
+        rows = conn.execute(select_sql, (last_id, batch_size)).fetchall()
+        while not rows:
+            # This backfill is done; move on to the next one
+            if names.index(name) + 1 == len(names):
+                return None, name, 0
+            name, last_id = names[names.index(name) + 1], 0
+            select_sql, compute, update_sql = BACKFILLS[name]
+            rows = conn.execute(select_sql, (last_id, batch_size)).fetchall()
+
+        updates = []
+        for image_id, filename in rows:
+            path = os.path.join(image_root, filename)
+            if not os.path.exists(path):
+                continue
+            try:
+                updates.append((compute(path, thumb_root, filename), image_id))
+            except Exception as e:
+                log.warning("Skipping %s for %s: %s", name, filename, e)
+        if updates:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(update_sql, updates)
+            conn.execute("COMMIT")
+        return (name, rows[-1][0]), name, len(updates)
+    finally:
+        conn.close()
+
+
+def run_backfills(db_path: str, batch_size: int = BACKFILL_BATCH_SIZE, pause: float = 0.0,
+                  should_stop=None) -> dict:
+    """
+    Run every backfill to completion, batch by batch (see backfill_batch). Stops early when
+    `should_stop()` returns True between batches; the rest is picked up on the next run.
+    Returns {backfill name: rows filled}.
+    """
+    filled = {name: 0 for name in BACKFILLS}
+    position = None
+    while not (should_stop and should_stop()):
+        position, name, count = backfill_batch(db_path, position, batch_size)
+        filled[name] += count
+        if position is None:
+            break
+        if pause:
+            time.sleep(pause)
+    for name, count in filled.items():
+        if count:
+            log.info("Backfilled %s for %d images", name, count)
+    return filled
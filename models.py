@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import declarative_base
 
@@ -13,15 +13,18 @@ class Settings(Base):
     interval_ms = Column(Integer, default=600000)
     order_mode = Column(String, default="added")  # added|random|custom
     slideshow_enabled = Column(Boolean, default=True)
+    dither_mode = Column(String, default="floyd-steinberg")  # see utils.dither.DITHER_MODES
 
 class Image(Base):
     __tablename__ = "images"
     id = Column(Integer, primary_key=True)
     filename = Column(String, unique=True, nullable=False)   # stored basename
+    content_hash = Column(String(64), index=True)   # SHA-256 of the original file, used to skip duplicate uploads
     original_name = Column(String)
     title = Column(String, default="")
     description = Column(Text, default="")
     exif_json = Column(Text, default="{}")
+    thumb_formats = Column(String, default="")  # e.g. "avif,webp,jpeg"; empty = legacy single thumbnail only
     width = Column(Integer, default=0)
     height = Column(Integer, default=0)
     enabled = Column(Boolean, default=True)
@@ -36,3 +39,23 @@ class Image(Base):
     crop_height = Column(Float, default=100.0)  # height %
     # Aspect ratio preservation option
     preserve_aspect_ratio = Column(Boolean, default=False)  # True = letterbox, False = crop-to-fill
+
+    __table_args__ = (
+        # Gallery pages: ORDER BY sort_order, created_at, id with a keyset cursor on the same columns
+        Index("ix_images_display_order", "sort_order", "created_at", "id"),
+        # Slideshow play queue: enabled images by last shown time, then added order
+        Index("ix_images_enabled_last_shown", "enabled", "last_shown_at", "created_at", "sort_order"),
+        # Crop recalculation for images still on the default full-frame crop
+        Index("ix_images_crop", "crop_width", "crop_height", "crop_x", "crop_y"),
+    )
+
+class UploadTask(Base):
+    """Persisted upload task status (see utils.task_store), so in-flight uploads survive a restart"""
+    __tablename__ = "upload_tasks"
+    id = Column(String, primary_key=True)   # task id handed to the client
+    state = Column(String, nullable=False)   # queued|processing|completed|error
+    status_json = Column(Text, default="{}")   # client-facing status
+    payload_json = Column(Text, default="{}")  # what the upload job needs to resume
+    created_at = Column(Float)    # unix timestamps
+    updated_at = Column(Float)
+    finished_at = Column(Float)
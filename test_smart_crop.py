@@ -3,39 +3,8 @@
 Test script to demonstrate smart crop calculations
 """
 
-def calculate_smart_crop(image_width, image_height, display_resolution):
-    """
-    Calculate smart default crop that centers the image if it needs cropping.
-    Returns (crop_x, crop_y, crop_width, crop_height) as percentages.
-    """
-    if not display_resolution or ',' not in display_resolution:
-        return 0, 0, 100, 100
-    
-    try:
-        display_width, display_height = map(int, display_resolution.split(','))
-        display_aspect = display_width / display_height
-        image_aspect = image_width / image_height
-        
-        if abs(display_aspect - image_aspect) < 0.01:
-            return 0, 0, 100, 100
-        
-        if image_aspect > display_aspect:
-            # Image is wider - crop horizontally, center left-right
-            crop_height = 100
-            crop_width = (display_aspect / image_aspect) * 100
-            crop_x = (100 - crop_width) / 2
-            crop_y = 0
-        else:
-            # Image is taller - crop vertically, center top-bottom  
-            crop_width = 100
-            crop_height = (image_aspect / display_aspect) * 100
-            crop_x = 0
-            crop_y = (100 - crop_height) / 2
-        
-        return round(crop_x, 2), round(crop_y, 2), round(crop_width, 2), round(crop_height, 2)
-        
-    except (ValueError, ZeroDivisionError):
-        return 0, 0, 100, 100
+from PIL import Image, ImageDraw
+from utils.crop_engine import calculate_smart_crop, saliency_crop
 
 # Test cases
 print("Smart Crop Calculator Demo")
@@ -68,3 +37,13 @@ for name, width, height in test_cases:
     elif crop_y > 0:
         print(f"  → Crop {crop_height}% height, centered vertically")
     print()
+
+# Saliency-positioned crops: the window size is the same, but it moves towards the subject
+print("Saliency Crop Demo")
+print("=" * 40)
+
+scene = Image.new("RGB", (160, 53), (120, 170, 220))  # plain sky, 6000x2000 thumbnail
+ImageDraw.Draw(scene).ellipse((125, 15, 150, 45), fill=(200, 40, 40))  # subject near the right edge
+crop_x, crop_y, crop_width, crop_height = saliency_crop(scene, 6000, 2000, display_res)
+print(f"Ultra Wide with subject on the right: x={crop_x}%, y={crop_y}%, w={crop_width}%, h={crop_height}%")
+print(f"  → Centered crop would start at x={calculate_smart_crop(6000, 2000, display_res)[0]}%")
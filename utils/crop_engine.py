@@ -0,0 +1,166 @@
+import numpy as np
+from PIL import Image
+
+# Default crop windows for the display's aspect ratio. The window size always matches the display;
+# its position is chosen from a saliency map of the image's smallest thumbnail, so the original is
+# never decoded. Everything here is picklable so library-wide runs can use a process pool.
+
+# Weight of the centre preference: 0 ignores the centre, larger values pull crops towards it
+CENTRE_BIAS = 0.35
+FULL_FRAME = (0, 0, 100, 100)
+
+
+def calculate_smart_crop(image_width, image_height, display_resolution):
+    """
+    Calculate smart default crop that centers the image if it needs cropping.
+    Returns (crop_x, crop_y, crop_width, crop_height) as percentages.
+    """
+    if not display_resolution or ',' not in display_resolution:
+        # Fallback to full image if no valid resolution
+        return FULL_FRAME
+
+    try:
+        display_width, display_height = map(int, display_resolution.split(','))
+        display_aspect = display_width / display_height
+        image_aspect = image_width / image_height
+
+        if abs(display_aspect - image_aspect) < 0.01:
+            # Aspect ratios are very close, use full image
+            return FULL_FRAME
+
+        if image_aspect > display_aspect:
+            # Image is wider than display - crop horizontally, center left-right
+            crop_height = 100  # Use full height
+            crop_width = (display_aspect / image_aspect) * 100
+            crop_x = (100 - crop_width) / 2  # Center horizontally
+            crop_y = 0
+        else:
+            # Image is taller than display - crop vertically, center top-bottom
+            crop_width = 100  # Use full width
+            crop_height = (image_aspect / display_aspect) * 100
+            crop_x = 0
+            crop_y = (100 - crop_height) / 2  # Center vertically
+
+        # Round to 2 decimal places
+        return round(crop_x, 2), round(crop_y, 2), round(crop_width, 2), round(crop_height, 2)
+
+    except (ValueError, ZeroDivisionError):
+        # Fallback to full image on any calculation error
+        return FULL_FRAME
+
+
+def saliency_map(image: Image.Image) -> np.ndarray:
+    """
+    Per-pixel interest of a small image: edge energy plus contrast against the image's
+    mean colour, so both detailed regions and subjects that stand out from the background score.
+    """
+    rgb = np.asarray(image.convert("RGB"), dtype=np.float32) / 255.0
+    lum = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    edges = np.zeros_like(lum)
+    edges[:, 1:] += np.abs(np.diff(lum, axis=1))
+    edges[1:, :] += np.abs(np.diff(lum, axis=0))
+
+    contrast = np.linalg.norm(rgb - rgb.reshape(-1, 3).mean(axis=0), axis=2)
+    saliency = edges / (edges.mean() + 1e-6) + contrast / (contrast.mean() + 1e-6)
+    return saliency
+
+
+def _best_offset(profile: np.ndarray, window: int) -> int:
+    """Start of the window with the most saliency, using prefix sums instead of a sliding loop"""
+    n = profile.shape[0]
+    if window >= n:
+        return 0
+    sums = np.concatenate(([0.0], np.cumsum(profile)))
+    scores = sums[window:] - sums[:-window]
+    # Gentle preference for central windows, which also settles ties on flat images
+    centres = (np.arange(scores.shape[0]) + window / 2) / n - 0.5
+    scores = scores / (scores.max() + 1e-6) - CENTRE_BIAS * centres ** 2 * 4
+    return int(scores.argmax())
+
+
+def saliency_crop(thumb, image_width, image_height, display_resolution):
+    """
+    Display-shaped crop positioned over the most salient part of an image.
+    `thumb` is a path to (or an opened) small thumbnail; returns percentages like calculate_smart_crop.
+    """
+    crop = calculate_smart_crop(image_width, image_height, display_resolution)
+    if crop == FULL_FRAME:
+        return crop
+    crop_x, crop_y, crop_width, crop_height = crop
+
+    image = Image.open(thumb) if isinstance(thumb, str) else thumb
+    saliency = saliency_map(image)
+    h, w = saliency.shape
+
+    if crop_width < 100:
+        window = max(1, round(w * crop_width / 100))
+        crop_x = _best_offset(saliency.sum(axis=0), window) / w * 100
+        crop_x = min(max(crop_x, 0), 100 - crop_width)
+    else:
+        window = max(1, round(h * crop_height / 100))
+        crop_y = _best_offset(saliency.sum(axis=1), window) / h * 100
+        crop_y = min(max(crop_y, 0), 100 - crop_height)
+    return round(crop_x, 2), round(crop_y, 2), crop_width, crop_height
+
+
+def _largest_window(w: np.ndarray, h: np.ndarray, aspect) -> tuple[np.ndarray, np.ndarray]:
+    """Size of the largest window with the given aspect ratio that fits inside each image"""
+    wide = w / h > aspect
+    return np.where(wide, h * aspect, w), np.where(wide, h, w / aspect)
+
+
+def refit_crops(widths, heights, crops, display_resolution) -> np.ndarray:
+    """
+    Reshape existing crops to a new display aspect ratio, keeping each crop's centre and zoom
+    (its size relative to the largest window that fits), so full-size crops stay full-size.
+    One row per image: `crops` is (n, 4) percentages, widths/heights are pixel sizes.
+    Returns an (n, 4) array of percentages.
+    """
+    display_width, display_height = map(int, display_resolution.split(','))
+    aspect = display_width / display_height
+    w = np.asarray(widths, dtype=np.float64)
+    h = np.asarray(heights, dtype=np.float64)
+    c = np.asarray(crops, dtype=np.float64).reshape(-1, 4)
+
+    crop_w = c[:, 2] * w / 100
+    crop_h = c[:, 3] * h / 100
+    centre_x = c[:, 0] * w / 100 + crop_w / 2
+    centre_y = c[:, 1] * h / 100 + crop_h / 2
+
+    old_max_w, _ = _largest_window(w, h, crop_w / crop_h)
+    zoom = np.clip(crop_w / old_max_w, 0, 1)
+    new_max_w, new_max_h = _largest_window(w, h, aspect)
+    new_w = new_max_w * zoom
+    new_h = new_max_h * zoom
+
+    x = np.clip(centre_x - new_w / 2, 0, w - new_w)
+    y = np.clip(centre_y - new_h / 2, 0, h - new_h)
+    return np.round(np.stack([x / w, y / h, new_w / w, new_h / h], axis=1) * 100, 2)
+
+
+def _crop_job(job, display_resolution):
+    image_id, thumb_path, image_width, image_height = job
+    try:
+        return image_id, saliency_crop(thumb_path, image_width, image_height, display_resolution)
+    except Exception:
+        # Missing or unreadable thumbnail: a centred crop is still a sensible default
+        return image_id, calculate_smart_crop(image_width, image_height, display_resolution)
+
+
+def _crop_chunk(jobs, display_resolution):
+    return [_crop_job(job, display_resolution) for job in jobs]
+
+
+def batch_saliency_crops(jobs, display_resolution, pool=None, chunk_size=64):
+    """
+    Crops for many images. `jobs` are (image_id, thumb_path, width, height) tuples; yields
+    (image_id, crop) chunk by chunk. With a process pool, chunks are computed in parallel.
+    """
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    if pool is None:
+        for chunk in chunks:
+            yield from _crop_chunk(chunk, display_resolution)
+        return
+    for results in pool.map(_crop_chunk, chunks, [display_resolution] * len(chunks)):
+        yield from results
@@ -0,0 +1,99 @@
+import threading, time
+
+# Coalescing hand-off between the request/slideshow threads and the display worker.
+# A panel refresh takes up to ~30 s, so at most one request waits behind the one being shown:
+# a newer request replaces it, except that a slideshow step never replaces a manual request.
+
+PRIORITY_MANUAL = 0
+PRIORITY_SLIDESHOW = 1
+
+_cond = threading.Condition()
+_state = {
+    "pending": None,      # (priority, item, queued_at)
+    "active": None,       # item being displayed
+    "active_since": None,
+    "closed": False,
+}
+_stats = {
+    "submitted": 0,
+    "displayed": 0,
+    "superseded": 0,      # pending request replaced by a newer one
+    "dropped": 0,         # slideshow request rejected because a manual one was pending
+    "last_display_seconds": None,
+    "last_wait_seconds": None,
+}
+
+
+def submit(item, priority: int = PRIORITY_MANUAL) -> bool:
+    """Queue an item for display. Returns False if it was dropped in favour of a pending request."""
+    with _cond:
+        _stats["submitted"] += 1
+        pending = _state["pending"]
+        if pending is not None:
+            if priority > pending[0]:
+                _stats["dropped"] += 1
+                return False
+            _stats["superseded"] += 1
+        _state["pending"] = (priority, item, time.monotonic())
+        _cond.notify()
+        return True
+
+
+def take(timeout: float | None = None):
+    """
+    Wait for the next item to display and mark it active; returns None on timeout or close.
+    Call done() once the item has been shown.
+    """
+    with _cond:
+        if not _cond.wait_for(lambda: _state["pending"] is not None or _state["closed"], timeout):
+            return None
+        if _state["closed"]:
+            return None
+        _, item, queued_at = _state["pending"]
+        _state["pending"] = None
+        _state["active"] = item
+        _state["active_since"] = time.monotonic()
+        _stats["last_wait_seconds"] = round(_state["active_since"] - queued_at, 3)
+        return item
+
+
+def done():
+    with _cond:
+        if _state["active_since"] is not None:
+            _stats["last_display_seconds"] = round(time.monotonic() - _state["active_since"], 3)
+            _stats["displayed"] += 1
+        _state["active"] = None
+        _state["active_since"] = None
+
+
+def has_pending(priority: int) -> bool:
+    """True if a request at `priority` or more urgent is waiting"""
+    with _cond:
+        pending = _state["pending"]
+        return pending is not None and pending[0] <= priority
+
+
+def start():
+    """Accept requests again after close()"""
+    with _cond:
+        _state["closed"] = False
+
+
+def close():
+    """Wake the worker and make take() return None; the pending request is discarded"""
+    with _cond:
+        _state["closed"] = True
+        _state["pending"] = None
+        _cond.notify_all()
+
+
+def stats() -> dict:
+    with _cond:
+        pending = _state["pending"]
+        return {
+            **_stats,
+            "depth": int(pending is not None),
+            "pending_priority": pending[0] if pending else None,
+            "busy": _state["active"] is not None,
+            "busy_seconds": round(time.monotonic() - _state["active_since"], 3) if _state["active_since"] else None,
+        }
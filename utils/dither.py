@@ -0,0 +1,66 @@
+import numpy as np
+from PIL import Image
+
+# Maps a rendered RGB frame onto the panel's colours ahead of time, so the Inky driver
+# receives a ready palette image instead of quantizing on every refresh.
+
+DITHER_MODES = {
+    "floyd-steinberg": "Error diffusion (smoothest)",
+    "ordered": "Ordered / Bayer (crisp, patterned)",
+    "none": "None (flat colours)",
+}
+DEFAULT_DITHER_MODE = "floyd-steinberg"
+
+# Spread of the ordered-dither threshold in 0-255 units; larger values dither more aggressively
+ORDERED_SPREAD = 96
+
+
+def _bayer(n: int) -> np.ndarray:
+    """n x n Bayer threshold matrix (n a power of two) with values in [0, 1)"""
+    m = np.zeros((1, 1), dtype=np.float32)
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return (m + 0.5) / (n * n)
+
+
+_BAYER8 = _bayer(8)
+
+
+def _palette_image(palette: list[tuple[int, int, int]]) -> Image.Image:
+    pal = Image.new("P", (1, 1))
+    flat = [c for rgb in palette for c in rgb]
+    pal.putpalette(flat + flat[:3] * (256 - len(palette)))
+    return pal
+
+
+def _nearest(pixels: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Index of the nearest palette colour for every pixel of an (h, w, 3) float array"""
+    flat = pixels.reshape(-1, 3)
+    # argmin |p - c|^2 == argmin (|c|^2 - 2 p.c); one matrix product instead of an (N, K, 3) temporary
+    scores = (palette * palette).sum(axis=1) - 2.0 * flat @ palette.T
+    return scores.argmin(axis=1).astype(np.uint8).reshape(pixels.shape[:2])
+
+
+def quantize(image: Image.Image, palette: list[tuple[int, int, int]], mode: str = DEFAULT_DITHER_MODE) -> Image.Image:
+    """
+    Convert an RGB frame to a "P" image whose indices are positions in `palette`.
+    Error diffusion is sequential by nature, so it uses Pillow's C implementation (the same
+    algorithm the Inky driver applies); the other modes are vectorized in NumPy.
+    """
+    image = image.convert("RGB")
+    if mode == "floyd-steinberg":
+        return image.quantize(colors=len(palette), palette=_palette_image(palette),
+                              dither=Image.Dither.FLOYDSTEINBERG)
+
+    pixels = np.asarray(image, dtype=np.float32)
+    if mode == "ordered":
+        h, w = pixels.shape[:2]
+        threshold = _BAYER8[np.arange(h)[:, None] % 8, np.arange(w)[None, :] % 8]
+        pixels = pixels + (threshold[..., None] - 0.5) * ORDERED_SPREAD
+    elif mode != "none":
+        raise ValueError(f"Unknown dither mode: {mode}")
+
+    indices = _nearest(pixels, np.asarray(palette, dtype=np.float32))
+    result = Image.frombytes("P", image.size, indices.tobytes())
+    result.putpalette(_palette_image(palette).getpalette())
+    return result
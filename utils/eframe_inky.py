@@ -1,6 +1,7 @@
 from PIL import Image
-import os
+import os, multiprocessing
 from dotenv import load_dotenv
+from utils.log import get_logger
 
 load_dotenv()
 
@@ -9,15 +10,21 @@ def is_dev_mode():
     env = os.getenv('ENVIRONMENT', '').lower()
     return env in ('development', 'dev')
 
+log = get_logger("inky")
+
 use_fake = is_dev_mode()
 
+# Upload worker processes re-import the app; only the main process may own the panel
+if multiprocessing.parent_process() is not None:
+    use_fake = True
+
 inky = None
 if not use_fake:
     try:
         from inky.auto import auto
         inky = auto(ask_user=True, verbose=True)
     except ImportError:
-        print("Warning: inky package not installed, running in fake mode")
+        log.warning("inky package not installed, running in fake mode")
         use_fake = True
 
 def get_inky_resolution():
@@ -25,10 +32,36 @@ def get_inky_resolution():
         return [800, 480]
     return [inky.resolution[0], inky.resolution[1]]
 
-def show_on_inky(imagepath, saturation=0.5):
+# Colour saturation passed to the Inky driver and used to build the panel palette
+PANEL_SATURATION = 0.5
+
+# 7-colour Inky Impression palette, used when no panel is attached (matches the driver's own tables)
+FALLBACK_SATURATED = [(0, 0, 0), (255, 255, 255), (0, 255, 0), (0, 0, 255), (255, 0, 0), (255, 255, 0), (255, 140, 0)]
+FALLBACK_DESATURATED = [(57, 48, 57), (255, 255, 255), (58, 91, 70), (61, 59, 94), (156, 72, 75), (208, 190, 71), (177, 106, 73)]
+
+def get_panel_palette(saturation=PANEL_SATURATION):
+    """
+    Colours the panel can show, in the driver's index order, as a list of (r, g, b).
+    A "P" image using these indices is passed to the panel without being quantized again.
+    """
+    if not use_fake and inky is not None and hasattr(inky, "_palette_blend"):
+        try:
+            flat = list(inky._palette_blend(saturation))
+            colours = [tuple(int(c) for c in flat[i:i + 3]) for i in range(0, len(flat), 3)]
+            # Drivers append a "clean" entry that repeats white; keep the first index of each colour
+            return list(dict.fromkeys(colours))
+        except Exception as e:
+            log.warning("Could not read the Inky palette, using the default: %s", e)
+    return [
+        tuple(round(s * saturation + d * (1 - saturation)) for s, d in zip(sat, desat))
+        for sat, desat in zip(FALLBACK_SATURATED, FALLBACK_DESATURATED)
+    ]
+
+def show_on_inky(image, saturation=PANEL_SATURATION):
+    """Show a frame on the panel; `image` is a PIL image (RGB, or "P" in panel palette order) or a path"""
     if use_fake or inky is None:
-        print(f"[DEV] Would display: {imagepath}")
+        log.info("Would display: %s", image if isinstance(image, str) else f"{image.width}x{image.height} frame")
         return
-    img = Image.open(imagepath)
+    img = Image.open(image) if isinstance(image, str) else image
     inky.set_image(img, saturation=saturation)
     inky.show()
@@ -0,0 +1,43 @@
+import asyncio, json, threading
+
+# Small in-process pub/sub used to push frame and upload changes to browsers (SSE).
+# Publishers are plain worker threads; subscribers are asyncio queues owned by the event loop.
+
+_subscribers: dict[asyncio.Queue, tuple[asyncio.AbstractEventLoop, frozenset]] = {}
+_lock = threading.Lock()
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def subscribe(topics=None, maxsize: int = 100) -> asyncio.Queue:
+    """Register a subscriber for the given topics (all topics if empty). Call from the event loop."""
+    q = asyncio.Queue(maxsize=maxsize)
+    with _lock:
+        _subscribers[q] = (asyncio.get_running_loop(), frozenset(topics or ()))
+    return q
+
+
+def unsubscribe(q: asyncio.Queue):
+    with _lock:
+        _subscribers.pop(q, None)
+
+
+def _deliver(q: asyncio.Queue, message: str):
+    try:
+        q.put_nowait(message)
+    except asyncio.QueueFull:
+        pass  # slow client; it will resync from the next event
+
+
+def publish(event: str, data: dict):
+    """Send an event to every interested subscriber. Safe to call from any thread."""
+    message = format_sse(event, data)
+    with _lock:
+        targets = [(q, loop) for q, (loop, topics) in _subscribers.items() if not topics or event in topics]
+    for q, loop in targets:
+        try:
+            loop.call_soon_threadsafe(_deliver, q, message)
+        except RuntimeError:
+            unsubscribe(q)  # loop already closed
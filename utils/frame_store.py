@@ -0,0 +1,203 @@
+import io, os, hashlib, threading, time
+from email.utils import formatdate, parsedate_to_datetime
+
+# Web copy of the frame on (or headed to) the e-ink display, also kept so it survives a restart
+CURRENT_FRAME = "static/current.jpg"
+# Recently published frames kept in memory, so versioned URLs handed out just before a change still resolve
+FRAME_RING_SIZE = 4
+JPEG_QUALITY = 90
+
+# A frame is a dict: generation, version, image (PIL, None for a frame restored from disk),
+# panel (the dithered panel-palette image, if any), mtime, and jpeg / panel_png (encoded on first request).
+# Readers never lock: _current and _ring are replaced wholesale, never mutated.
+_current = None
+_ring: dict[str, dict] = {}  # version -> frame
+_disk = None  # (stat key, frame) for CURRENT_FRAME when nothing was published by this process
+
+# Publishing state, guarded by _ticket_lock; _render_lock serializes the renders themselves.
+# "pending" is the ticket still on its way to publishing (0 if none) and "priority" its priority.
+_ticket_lock = threading.Lock()
+_render_lock = threading.Lock()
+_encode_lock = threading.Lock()
+_state = {"ticket": 0, "pending": 0, "priority": 0, "generation": 0}
+
+
+def _stat_key(st: os.stat_result) -> tuple:
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _image_version(*images) -> str:
+    h = hashlib.sha1()
+    for image in images:
+        if image is not None:
+            h.update(f"{image.mode}{image.size}{image.getpalette()}".encode())
+            h.update(image.tobytes())
+    return h.hexdigest()[:16]
+
+
+def _from_disk() -> dict | None:
+    """The frame left in CURRENT_FRAME by a previous run"""
+    global _disk
+    try:
+        st = os.stat(CURRENT_FRAME)
+    except OSError:
+        return None
+    disk = _disk
+    if disk and disk[0] == _stat_key(st):
+        return disk[1]
+    try:
+        with open(CURRENT_FRAME, "rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+    except OSError:
+        return None
+    frame = {"generation": 0, "version": hashlib.sha1(data).hexdigest()[:16],
+             "image": None, "panel": None, "mtime": st.st_mtime, "jpeg": data, "panel_png": None}
+    _disk = (_stat_key(st), frame)
+    return frame
+
+
+def current() -> dict | None:
+    return _current or _from_disk()
+
+
+def _encoded(frame: dict) -> bytes:
+    """JPEG bytes of a frame, encoding it the first time a browser asks for it"""
+    data = frame["jpeg"]
+    if data is not None:
+        return data
+    with _encode_lock:
+        if frame["jpeg"] is None:
+            buf = io.BytesIO()
+            frame["image"].save(buf, "JPEG", quality=JPEG_QUALITY)
+            frame["jpeg"] = buf.getvalue()
+            if frame is _current:
+                _write_current(frame)
+    return frame["jpeg"]
+
+
+def _encoded_panel(frame: dict) -> bytes | None:
+    """PNG of the panel-palette image: exactly what the e-ink display is given"""
+    if frame["panel_png"] is None and frame["panel"] is not None:
+        with _encode_lock:
+            if frame["panel_png"] is None:
+                buf = io.BytesIO()
+                frame["panel"].save(buf, "PNG")
+                frame["panel_png"] = buf.getvalue()
+    return frame["panel_png"]
+
+
+def _write_current(frame: dict):
+    os.makedirs(os.path.dirname(CURRENT_FRAME), exist_ok=True)
+    tmp_path = f"{CURRENT_FRAME}.{frame['generation']}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(frame["jpeg"])
+    os.replace(tmp_path, CURRENT_FRAME)
+
+
+def load() -> tuple[bytes, str, float] | None:
+    """Current frame as (jpeg, version, mtime), or None if nothing has been rendered yet"""
+    frame = current()
+    if frame is None:
+        return None
+    return _encoded(frame), frame["version"], frame["mtime"]
+
+
+def load_version(version: str) -> tuple[bytes, str, float] | None:
+    """A specific frame version, as long as it is current or still in the ring"""
+    frame = current()
+    if not frame or frame["version"] != version:
+        frame = _ring.get(version)
+    if frame is None:
+        return None
+    return _encoded(frame), frame["version"], frame["mtime"]
+
+
+def load_panel(version: str | None = None) -> tuple[bytes, str, float] | None:
+    """Panel preview (PNG) of the current frame or of a recent version, if it was dithered ahead of time"""
+    frame = current()
+    if version is not None and (not frame or frame["version"] != version):
+        frame = _ring.get(version)
+    if frame is None:
+        return None
+    data = _encoded_panel(frame)
+    if data is None:
+        return None
+    return data, frame["version"], frame["mtime"]
+
+
+def version() -> str | None:
+    frame = current()
+    return frame["version"] if frame else None
+
+
+def publish(render, priority: int = 0) -> dict | None:
+    """
+    Render a new current frame and swap it in.
+    `render()` must return (frame, panel): the frame as an RGB PIL image and optionally its
+    panel-palette version (or None to let the driver quantize). Concurrent calls are serialized and the most
+    recent call wins, unless it is less important than the call in flight: `priority` works as in
+    display_queue (lower is more important), and a call is dropped at once while a more important
+    one has yet to publish. A call that is superseded while it waits or renders is dropped and returns
+    None. Otherwise returns the published frame; its images go to the display as-is and the
+    web JPEG / panel PNG are only encoded when requested.
+    """
+    with _ticket_lock:
+        if _state["pending"] and priority > _state["priority"]:
+            return None  # e.g. a slideshow step while a "show now" is rendering
+        _state["ticket"] += 1
+        ticket = _state["ticket"]
+        _state["pending"], _state["priority"] = ticket, priority
+
+    try:
+        return _publish(render, ticket)
+    finally:
+        with _ticket_lock:
+            if _state["pending"] == ticket:
+                _state["pending"] = 0
+
+
+def _publish(render, ticket: int) -> dict | None:
+    global _current, _ring
+    with _render_lock:
+        if ticket != _state["ticket"]:
+            return None  # a newer request is queued behind us; don't render a frame nobody will see
+
+        image, panel = render()
+        if ticket != _state["ticket"]:
+            return None  # superseded mid-render; the newer request publishes next
+
+        _state["generation"] += 1
+        frame = {"generation": _state["generation"], "version": _image_version(image, panel),
+                 "image": image, "panel": panel, "mtime": time.time(), "jpeg": None, "panel_png": None}
+        ring = {v: f for v, f in _ring.items() if v != frame["version"]}
+        ring[frame["version"]] = frame
+        _ring = dict(list(ring.items())[-FRAME_RING_SIZE:])
+        _current = frame
+        return frame
+
+
+def etag(version: str) -> str:
+    return f'"{version}"'
+
+
+def last_modified(mtime: float) -> str:
+    return formatdate(mtime, usegmt=True)
+
+
+def not_modified(headers, version: str, mtime: float) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against the current frame (RFC 9110 precedence)"""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        # Weak comparison, as required for If-None-Match
+        return "*" in tags or any(t.removeprefix("W/") == etag(version) for t in tags)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
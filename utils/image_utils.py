@@ -1,6 +1,11 @@
-import os, json, hashlib
-from PIL import Image, ImageOps, ExifTags
+import os, json, hashlib, math, shutil
+from PIL import Image, ImageOps, ExifTags, features
 from datetime import datetime
+from utils.crop_engine import saliency_crop
+
+# Long-side sizes of the responsive thumbnail pyramid
+THUMB_SIZES = (160, 480, 1024)
+THUMB_EXTENSIONS = {"avif": "avif", "webp": "webp", "jpeg": "jpg"}
 
 def ensure_dirs(*paths):
     for p in paths:
@@ -29,13 +34,10 @@ def letterbox_to(image: Image.Image, target_w: int, target_h: int) -> Image.Imag
     # preserves aspect ratio, pads with black
     return ImageOps.pad(image, (target_w, target_h), color="black", method=Image.Resampling.LANCZOS)
 
-def crop_and_fill(image: Image.Image, target_w: int, target_h: int, crop_x: int = 0, crop_y: int = 0, crop_width: int = 100, crop_height: int = 100) -> Image.Image:
+def crop_box(orig_w: int, orig_h: int, crop_x: float = 0, crop_y: float = 0, crop_width: float = 100, crop_height: float = 100) -> tuple[int, int, int, int]:
     """
-    Crop a region from the image and fill the target dimensions
-    crop_x, crop_y, crop_width, crop_height are percentages (0-100)
+    Convert percentage crop settings (0-100) to a pixel box clamped to the image
     """
-    orig_w, orig_h = image.size
-    
     # Convert percentages to pixels
     left = int(orig_w * crop_x / 100)
     top = int(orig_h * crop_y / 100)
@@ -47,35 +49,132 @@ def crop_and_fill(image: Image.Image, target_w: int, target_h: int, crop_x: int
     top = max(0, min(top, orig_h - 1))
     right = min(orig_w, left + width)
     bottom = min(orig_h, top + height)
+    return left, top, right, bottom
+
+def crop_and_fill(image: Image.Image, target_w: int, target_h: int, crop_x: int = 0, crop_y: int = 0, crop_width: int = 100, crop_height: int = 100) -> Image.Image:
+    """
+    Crop a region from the image and fill the target dimensions
+    crop_x, crop_y, crop_width, crop_height are percentages (0-100)
+    """
+    box = crop_box(image.width, image.height, crop_x, crop_y, crop_width, crop_height)
+    
+    # Resize straight from the crop box (may stretch slightly); reducing_gap lets Pillow
+    # box-reduce large crops in integer steps before the final LANCZOS pass
+    return image.resize((target_w, target_h), Image.Resampling.LANCZOS, box=box, reducing_gap=3.0)
+
+def open_for_render(src_path: str, target_w: int, target_h: int, crop_x: float = 0, crop_y: float = 0,
+                    crop_width: float = 100, crop_height: float = 100, preserve_aspect_ratio: bool = False) -> Image.Image:
+    """
+    Open an image decoded at the smallest scale that still covers the target frame.
+    JPEGs are scaled during decode (1/2, 1/4 or 1/8) so a 12 MP original never gets
+    fully decoded into memory just to produce an 800x480 frame.
+    """
+    img = Image.open(src_path)
+    orig_w, orig_h = img.size
     
-    # Crop the image
-    cropped = image.crop((left, top, right, bottom))
+    if preserve_aspect_ratio:
+        # Letterbox: the whole image is fitted inside the frame
+        scale = min(target_w / orig_w, target_h / orig_h)
+        needed = (math.ceil(orig_w * scale), math.ceil(orig_h * scale))
+    else:
+        # Crop-to-fill: only the crop region has to reach the frame size
+        needed = (math.ceil(target_w * 100 / max(crop_width or 100, 1)),
+                  math.ceil(target_h * 100 / max(crop_height or 100, 1)))
     
-    # Resize to fill target dimensions (may stretch slightly)
-    return cropped.resize((target_w, target_h), Image.Resampling.LANCZOS)
+    # No-op for formats without scale-on-decode support
+    img.draft("RGB", needed)
+    return img.convert("RGB")
 
-def save_upload(fileobj, upload_dir: str, thumb_dir: str) -> tuple[str, int, int, str]:
-    ensure_dirs(upload_dir, thumb_dir)
-    original_name = getattr(fileobj, "filename", "upload")
+def file_hash(path: str) -> str:
+    """SHA-256 of a file, read in 1 MB blocks"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def store_upload(staged_path: str, original_name: str, upload_dir: str) -> str:
+    """Move a staged upload into the upload directory under a unique name"""
+    ensure_dirs(upload_dir)
     safe_name = hash_name(os.path.basename(original_name))
-    dest_path = os.path.join(upload_dir, safe_name)
-    with open(dest_path, "wb") as out:
-        out.write(fileobj.file.read())
+    # A rename when staging and uploads share a filesystem, a copy otherwise
+    shutil.move(staged_path, os.path.join(upload_dir, safe_name))
+    return safe_name
+
+def thumb_formats() -> list[str]:
+    """Thumbnail formats this Pillow build can encode, best compression first; JPEG always last"""
+    wanted = os.getenv("THUMB_FORMATS", "avif,webp").split(",")
+    fmts = [f for f in ("avif", "webp") if f in wanted and features.check(f)]
+    return fmts + ["jpeg"]
 
-    img = Image.open(dest_path).convert("RGB")
+def thumb_path(thumb_dir: str, filename: str, size: int, fmt: str) -> str:
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(thumb_dir, str(size), f"{stem}.{THUMB_EXTENSIONS[fmt]}")
+
+def thumbnail_paths(thumb_dir: str, filename: str) -> list[str]:
+    """Every thumbnail file that may exist for an image, including the legacy single thumbnail"""
+    paths = [os.path.join(thumb_dir, filename)]
+    for size in THUMB_SIZES:
+        for fmt in THUMB_EXTENSIONS:
+            paths.append(thumb_path(thumb_dir, filename, size, fmt))
+    return paths
+
+def write_thumbnails(img: Image.Image, thumb_dir: str, filename: str) -> str:
+    """
+    Write the thumbnail pyramid for an opened image in every supported format.
+    Returns the formats written as a comma separated string.
+    """
+    fmts = thumb_formats()
+    # thumbnail() drafts the JPEG decode down to the nearest scale above the largest size
+    img.thumbnail((THUMB_SIZES[-1], THUMB_SIZES[-1]))
+    level = img.convert("RGB")
+
+    # Largest first, so each level is downscaled from the previous one
+    for size in sorted(THUMB_SIZES, reverse=True):
+        level.thumbnail((size, size), Image.Resampling.LANCZOS)
+        ensure_dirs(os.path.join(thumb_dir, str(size)))
+        for fmt in fmts:
+            path = thumb_path(thumb_dir, filename, size, fmt)
+            if fmt == "avif":
+                level.save(path, "AVIF", quality=60, speed=8)
+            elif fmt == "webp":
+                level.save(path, "WEBP", quality=80, method=4)
+            else:
+                level.save(path, "JPEG", quality=85, optimize=True)
+        if size == 480:
+            # Legacy single thumbnail, still used by older clients and tools
+            level.save(os.path.join(thumb_dir, filename), "JPEG", quality=85)
+    return ",".join(fmts)
+
+def process_upload(dest_path: str, thumb_dir: str, resolution: str | None = None) -> tuple[int, int, str, str, tuple | None]:
+    """
+    Read size and EXIF, write the thumbnail pyramid and, given the display resolution,
+    choose a saliency-based default crop for a stored upload.
+    Self-contained so it can run in a worker process.
+    """
+    ensure_dirs(thumb_dir)
+
+    # Size and EXIF come from the header; no pixels are decoded for them
+    img = Image.open(dest_path)
     w, h = img.size
     exif_json = extract_exif_as_json(img)
 
-    # thumbnail (max 480px on long side)
-    t = img.copy()
-    t.thumbnail((480, 480))
-    t.save(os.path.join(thumb_dir, safe_name), "JPEG", quality=85)
+    filename = os.path.basename(dest_path)
+    formats = write_thumbnails(img, thumb_dir, filename)
+
+    crop = None
+    if resolution:
+        try:
+            crop = saliency_crop(thumb_path(thumb_dir, filename, THUMB_SIZES[0], "jpeg"), w, h, resolution)
+        except Exception:
+            pass  # caller falls back to a centred crop
 
-    return safe_name, w, h, exif_json
+    return w, h, exif_json, formats, crop
 
-def render_to_output(src_path: str, output_path: str, resolution: str, crop_x: int = 0, crop_y: int = 0, crop_width: int = 100, crop_height: int = 100, preserve_aspect_ratio: bool = False):
+def render_frame(src_path: str, resolution: str, crop_x: float = 0, crop_y: float = 0, crop_width: float = 100, crop_height: float = 100, preserve_aspect_ratio: bool = False) -> Image.Image:
+    """Render an image at the display resolution and return it as an RGB image"""
     w, h = [int(x) for x in resolution.split(",")]
-    img = Image.open(src_path).convert("RGB")
+    img = open_for_render(src_path, w, h, crop_x, crop_y, crop_width, crop_height, preserve_aspect_ratio)
     
     if preserve_aspect_ratio:
         # Use letterboxing to preserve original aspect ratio
@@ -83,6 +182,4 @@ def render_to_output(src_path: str, output_path: str, resolution: str, crop_x: i
     else:
         # Use crop-and-fill for full coverage
         framed = crop_and_fill(img, w, h, crop_x, crop_y, crop_width, crop_height)
-    
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    framed.save(output_path, "JPEG", quality=90)
+    return framed.convert("RGB")
@@ -0,0 +1,267 @@
+import asyncio, itertools, os, threading, time, uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from utils.log import get_logger
+
+# Scheduler for all background work: display refreshes, renders, slideshow slots, upload
+# batches, thumbnail backfills and crop recalculation run as jobs on one set of worker threads.
+#
+# Every job has a kind, and each kind limits how many of its jobs run at once. CPU-heavy kinds
+# also share CPU_SLOTS, so a crop recalculation can't take every core while a render is waiting.
+# Queued jobs start in priority order (then oldest first), optionally not before a delay.
+# Priority can't preempt a running job, so PRIORITY_HIGH jobs may also use RESERVED_SLOTS
+# beyond CPU_SLOTS: a render someone is waiting for starts even while background jobs hold every
+# slot. Library-wide work (backfills, crop recalculation) runs as a chain of small jobs, each
+# queueing the next, so it gives up its slot between batches.
+# Workers sleep on a condition variable and are woken by submit/finish/cancel, or when the
+# earliest delayed job falls due, so an idle frame uses no CPU.
+#
+# Work that is CPU-heavy only in places (upload decoding, inline or on the process pool) takes a
+# slot per piece with take_cpu_slot() / release_cpu_slot() instead of holding one for the whole job.
+#
+# cancel() drops a queued job; a running one is only flagged, and long jobs check cancelled()
+# between steps. submit() returns None when a kind's queue limit is reached, so callers can
+# answer 503 rather than piling up renders the panel could never show anyway.
+#
+# offload() is separate: it awaits a short call on its own small pool for async handlers
+# that need the result inline (e.g. hashing upload chunks).
+
+log = get_logger("jobs")
+
+PRIORITY_HIGH = 0    # a user is waiting on it (show now)
+PRIORITY_NORMAL = 1  # slideshow slots, uploads
+PRIORITY_LOW = 2     # look-ahead renders, crop recalculation, backfills
+
+CPU_SLOTS = max(1, int(os.getenv("CPU_SLOTS", os.cpu_count() or 1)))
+RESERVED_SLOTS = 1  # extra CPU slots only PRIORITY_HIGH jobs may take
+JOB_QUEUE_LIMIT = max(1, int(os.getenv("JOB_QUEUE_LIMIT", 8)))
+JOB_HISTORY = 100  # finished jobs kept for polling
+OFFLOAD_WORKERS = 2
+
+# kind -> limit: running at once, cpu: counts against CPU_SLOTS, queue: max queued + running (None = unbounded)
+KINDS = {
+    "render": {"limit": max(1, int(os.getenv("JOB_WORKERS", 2))), "cpu": True, "queue": JOB_QUEUE_LIMIT},
+    "slideshow": {"limit": 1, "cpu": True, "queue": None},
+    "display": {"limit": 1, "cpu": False, "queue": None},    # one panel; the refresh is spent waiting on SPI
+    "upload": {"limit": 1, "cpu": False, "queue": None},     # takes a CPU slot per file it decodes
+    "thumbnail": {"limit": 1, "cpu": True, "queue": None},
+    "recrop": {"limit": 1, "cpu": True, "queue": None},
+    "watchdog": {"limit": 1, "cpu": False, "queue": None},   # upload task timeouts and eviction
+    "tasks": {"limit": 1, "cpu": False, "queue": None},      # writing upload task status to SQLite
+}
+
+_cond = threading.Condition()
+_jobs: "OrderedDict[str, dict]" = OrderedDict()  # job id -> job, queued, running and recent
+_queued: list[dict] = []
+_running = {kind: 0 for kind in KINDS}
+_state = {"threads": [], "closed": False, "cpu": 0, "offload": None}
+_seq = itertools.count()
+_local = threading.local()
+
+
+def _public(job: dict) -> dict:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def _finish(job: dict, **fields):
+    """Mark a job finished (caller holds _cond)"""
+    job.update(fields, finished_at=datetime.now().isoformat())
+    finished = [job_id for job_id, j in _jobs.items() if j["status"] in ("done", "failed", "cancelled")]
+    for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+        del _jobs[job_id]
+
+
+def _pick(now: float) -> tuple[dict | None, float | None]:
+    """Next runnable job, or None and how long until a delayed one falls due (caller holds _cond)"""
+    best, wait = None, None
+    for job in _queued:
+        if job["_run_at"] > now:
+            due = job["_run_at"] - now
+            wait = due if wait is None else min(wait, due)
+            continue
+        kind = KINDS[job["kind"]]
+        slots = CPU_SLOTS + (RESERVED_SLOTS if job["priority"] == PRIORITY_HIGH else 0)
+        if _running[job["kind"]] >= kind["limit"] or (kind["cpu"] and _state["cpu"] >= slots):
+            continue
+        if best is None or (job["priority"], job["_seq"]) < (best["priority"], best["_seq"]):
+            best = job
+    return best, wait
+
+
+def _worker():
+    while True:
+        with _cond:
+            while True:
+                if _state["closed"]:
+                    return
+                job, wait = _pick(time.monotonic())
+                if job:
+                    break
+                _cond.wait(wait)
+            _queued.remove(job)
+            _running[job["kind"]] += 1
+            if KINDS[job["kind"]]["cpu"]:
+                _state["cpu"] += 1
+            job.update(status="running", started_at=datetime.now().isoformat())
+
+        _local.job = job
+        t0 = time.monotonic()
+        try:
+            fields = {"status": "done", "result": job["_fn"](*job["_args"])}
+        except Exception as e:
+            log.exception("%s job %s failed: %s", job["kind"], job["id"], e)
+            fields = {"status": "failed", "error": str(e)}
+        _local.job = None
+
+        with _cond:
+            _running[job["kind"]] -= 1
+            if KINDS[job["kind"]]["cpu"]:
+                _state["cpu"] -= 1
+            if job["_cancel"] and fields["status"] == "done":
+                fields["status"] = "cancelled"
+            _finish(job, seconds=round(time.monotonic() - t0, 3), **fields)
+            # Capacity was freed, possibly for a different kind than the one waiting first
+            _cond.notify_all()
+
+
+def submit(kind: str, fn, *args, priority: int = PRIORITY_NORMAL, delay: float = 0.0, key: str | None = None) -> dict | None:
+    """
+    Queue fn(*args) as a `kind` job, to start no sooner than `delay` seconds from now.
+    With a `key`, a job with the same key that is still queued is returned instead of adding another.
+    Returns a snapshot of the job, or None if the kind's queue is full or the scheduler is shut down.
+    """
+    with _cond:
+        if _state["closed"]:
+            return None
+        if key is not None:
+            for job in _queued:
+                if job["_key"] == key:
+                    return _public(job)
+        limit = KINDS[kind]["queue"]
+        if limit is not None and sum(1 for j in _queued if j["kind"] == kind) + _running[kind] >= limit:
+            return None
+        job = {"id": uuid.uuid4().hex, "kind": kind, "priority": priority, "status": "queued",
+               "result": None, "error": None, "created_at": datetime.now().isoformat(),
+               "started_at": None, "finished_at": None, "seconds": None,
+               "_fn": fn, "_args": args, "_key": key, "_seq": next(_seq),
+               "_run_at": time.monotonic() + max(0.0, delay), "_cancel": False}
+        _jobs[job["id"]] = job
+        _queued.append(job)
+        _cond.notify()
+        return _public(job)
+
+
+def cancel(job_id: str | None) -> bool:
+    """Drop a queued job, or ask a running one to stop. Returns False if it already finished."""
+    with _cond:
+        job = _jobs.get(job_id)
+        if not job or job["status"] not in ("queued", "running"):
+            return False
+        job["_cancel"] = True
+        if job["status"] == "queued":
+            _queued.remove(job)
+            _finish(job, status="cancelled")
+        # Wakes queued work, and a running job waiting in take_cpu_slot()
+        _cond.notify_all()
+        return True
+
+
+def cancelled() -> bool:
+    """True inside a running job that has been asked to stop"""
+    job = getattr(_local, "job", None)
+    return bool(job and job["_cancel"])
+
+
+def current_id() -> str | None:
+    """Id of the job running on this thread, None outside a job"""
+    job = getattr(_local, "job", None)
+    return job["id"] if job else None
+
+
+def _cpu_wanted(priority: int, now: float) -> bool:
+    """True if a due CPU job at least as important as `priority` is waiting for a slot (caller holds _cond)"""
+    return any(j["_run_at"] <= now and KINDS[j["kind"]]["cpu"] and j["priority"] <= priority
+               and _running[j["kind"]] < KINDS[j["kind"]]["limit"] for j in _queued)
+
+
+def take_cpu_slot(priority: int = PRIORITY_NORMAL):
+    """
+    Wait for a CPU slot and take it, for CPU-heavy work outside a CPU kind. Queued CPU jobs at least
+    as important as `priority` go first, and the reserved slots are left to PRIORITY_HIGH jobs.
+    Stops waiting when the calling job is cancelled or the scheduler shuts down. Pair with release_cpu_slot().
+    """
+    with _cond:
+        while not (_state["closed"] or cancelled()):
+            if _state["cpu"] < CPU_SLOTS and not _cpu_wanted(priority, time.monotonic()):
+                break
+            _cond.wait(1.0)
+        _state["cpu"] += 1
+
+
+def release_cpu_slot():
+    with _cond:
+        _state["cpu"] -= 1
+        _cond.notify_all()
+
+
+def get(job_id: str) -> dict | None:
+    with _cond:
+        job = _jobs.get(job_id)
+        return _public(job) if job else None
+
+
+async def offload(fn, *args):
+    """Await fn(*args) on the offload pool instead of running it on the event loop"""
+    with _cond:
+        if _state["offload"] is None:
+            _state["offload"] = ThreadPoolExecutor(OFFLOAD_WORKERS, thread_name_prefix="offload")
+        pool = _state["offload"]
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+def stats() -> dict:
+    with _cond:
+        return {
+            "cpu": {"busy": _state["cpu"], "slots": CPU_SLOTS, "reserved": RESERVED_SLOTS},
+            "kinds": {kind: {"running": _running[kind], "limit": spec["limit"],
+                             "queued": sum(1 for j in _queued if j["kind"] == kind)}
+                      for kind, spec in KINDS.items()},
+        }
+
+
+def start():
+    """Start the worker threads: one per slot any kind could use at once"""
+    with _cond:
+        if any(t.is_alive() for t in _state["threads"]):
+            return
+        _state["closed"] = False
+        _state["threads"] = [threading.Thread(target=_worker, name=f"jobs-{i}", daemon=True)
+                             for i in range(sum(spec["limit"] for spec in KINDS.values()))]
+        for t in _state["threads"]:
+            t.start()
+    log.info("Scheduler started: %d workers, %d CPU slots", len(_state["threads"]), CPU_SLOTS)
+
+
+def shutdown(timeout: float = 5.0):
+    """Cancel queued jobs, ask running ones to stop, and wait up to `timeout` for the workers"""
+    with _cond:
+        _state["closed"] = True
+        for job in list(_queued):
+            job["_cancel"] = True
+            _finish(job, status="cancelled")
+        _queued.clear()
+        for job in _jobs.values():
+            if job["status"] == "running":
+                job["_cancel"] = True
+        _cond.notify_all()
+        threads, _state["threads"] = _state["threads"], []
+        pool, _state["offload"] = _state["offload"], None
+
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+    busy = sum(t.is_alive() for t in threads)
+    log.info("Scheduler stopped (%d jobs still finishing)", busy)
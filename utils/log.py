@@ -0,0 +1,69 @@
+import json, logging, os, sys
+
+# Logging for the app, its background jobs and the migrations.
+#
+# Every area has its own logger under "eframe" (get_logger("upload") -> "eframe.upload"), so one
+# area can be turned up without the rest. Log with %-style arguments, never f-strings:
+#     log.debug("Saved %s (%d bytes)", name, size)
+# A message below the current level then costs one level check; the arguments are never
+# formatted. Wrap anything costly to *compute* for a debug line in log.isEnabledFor(logging.DEBUG).
+#
+# LOG_LEVEL (default INFO, DEBUG in development mode) sets the level at startup and
+# set_level() changes it at runtime (POST /logging). LOG_FORMAT=json writes one JSON object
+# per line, including any `extra={...}` fields passed to the call.
+
+ROOT = "eframe"
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record), "level": record.levelname,
+                 "logger": record.name, "message": record.getMessage()}
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def setup(dev_mode: bool = False):
+    """Attach the handler and apply LOG_LEVEL / LOG_FORMAT; safe to call more than once"""
+    root = logging.getLogger(ROOT)
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        json_format = os.getenv("LOG_FORMAT", "text").lower() == "json"
+        handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        # Uvicorn configures its own loggers; don't print everything twice through the root logger
+        root.propagate = False
+    # Nothing logged uses these record attributes, so don't pay for collecting them
+    logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+    set_level(os.getenv("LOG_LEVEL", "DEBUG" if dev_mode else "INFO"))
+
+
+def set_level(level: str, name: str | None = None) -> str:
+    """Set the level of all app logging, or of one area (`name`, e.g. "upload"); returns the level"""
+    level = level.upper()
+    # NOTSET hands an area back to the app-wide level
+    if level not in LEVELS and not (name and level == "NOTSET"):
+        raise ValueError(f"Unknown log level {level!r}, expected one of {', '.join(LEVELS)}")
+    (get_logger(name) if name else logging.getLogger(ROOT)).setLevel(level)
+    return level
+
+
+def levels() -> dict:
+    """Current level of the app logger and of every area that has its own"""
+    manager = logging.Logger.manager
+    found = {ROOT: logging.getLevelName(logging.getLogger(ROOT).level)}
+    for name, logger in list(manager.loggerDict.items()):
+        if name.startswith(f"{ROOT}.") and isinstance(logger, logging.Logger) and logger.level:
+            found[name] = logging.getLevelName(logger.level)
+    return found
@@ -0,0 +1,134 @@
+import random, threading
+from collections import deque
+
+# In-memory play order for the slideshow, so choosing the next image is O(1) instead of a
+# sorted query over the whole library on every tick.
+#
+# "added" / "custom": never-shown images first, then a rotation in least-recently-shown order,
+# which is exactly the order the old ORDER BY produced.
+# "random": a shuffle bag; every enabled image is shown once before any repeats.
+#
+# Entries are (image_id, token) and an entry only counts while its token matches live[image_id],
+# so removing or moving an image never scans the queue: stale entries are skipped when reached.
+
+_lock = threading.Lock()
+_state = {
+    "mode": None,       # order mode the queue was built for; None = needs a rebuild
+    "fresh": deque(),   # never shown, in library order
+    "cycle": deque(),   # shown before, least recently shown first
+    "bag": [],          # random mode: remaining shuffle, next image at the end
+    "live": {},         # image_id -> current token, for every enabled image
+    "tokens": 0,
+    "last": None,       # last image played, so a new shuffle doesn't open with it
+}
+
+
+def _token(image_id: int) -> int:
+    _state["tokens"] += 1
+    _state["live"][image_id] = _state["tokens"]
+    return _state["tokens"]
+
+
+def _compact():
+    """Drop stale entries once they outnumber live ones"""
+    live = _state["live"]
+    size = len(_state["fresh"]) + len(_state["cycle"]) + len(_state["bag"])
+    if size > 2 * len(live) + 64:
+        for key in ("fresh", "cycle"):
+            _state[key] = deque(e for e in _state[key] if live.get(e[0]) == e[1])
+        _state["bag"] = [e for e in _state["bag"] if live.get(e[0]) == e[1]]
+
+
+def _refill_bag():
+    ids = list(_state["live"])
+    random.shuffle(ids)
+    if len(ids) > 1 and ids[-1] == _state["last"]:
+        ids[0], ids[-1] = ids[-1], ids[0]
+    _state["bag"] = [(i, _token(i)) for i in ids]
+
+
+def is_loaded(mode: str) -> bool:
+    with _lock:
+        return _state["mode"] == mode
+
+
+def load(mode: str, fresh_ids, cycle_ids):
+    """
+    Rebuild the queue from the library: `fresh_ids` are enabled images never shown (in library
+    order) and `cycle_ids` the rest, least recently shown first. Random mode ignores the order.
+    """
+    with _lock:
+        _state.update(mode=mode, fresh=deque(), cycle=deque(), bag=[], live={})
+        if mode == "random":
+            for i in list(fresh_ids) + list(cycle_ids):
+                _token(i)
+            _refill_bag()
+        else:
+            _state["fresh"].extend((i, _token(i)) for i in fresh_ids)
+            _state["cycle"].extend((i, _token(i)) for i in cycle_ids)
+
+
+def invalidate():
+    """Force a rebuild before the next pick (order mode or custom sort order changed)"""
+    with _lock:
+        _state["mode"] = None
+
+
+def peek() -> int | None:
+    """The image the slideshow would show next, without consuming it"""
+    with _lock:
+        live = _state["live"]
+        if not live:
+            return None
+        if _state["mode"] == "random":
+            bag = _state["bag"]
+            while bag and live.get(bag[-1][0]) != bag[-1][1]:
+                bag.pop()
+            if not bag:
+                _refill_bag()
+                bag = _state["bag"]
+            return bag[-1][0]
+        for key in ("fresh", "cycle"):
+            q = _state[key]
+            while q and live.get(q[0][0]) != q[0][1]:
+                q.popleft()
+            if q:
+                return q[0][0]
+        return None
+
+
+def played(image_id: int):
+    """Record that an image was put on the display (by the slideshow or manually)"""
+    with _lock:
+        _state["last"] = image_id
+        if image_id not in _state["live"]:
+            return  # disabled, or not loaded yet
+        token = _token(image_id)  # invalidates its current position
+        if _state["mode"] != "random":
+            _state["cycle"].append((image_id, token))
+        # random: the image simply leaves this round's bag and returns in the next shuffle
+        _compact()
+
+
+def add(image_id: int, shown: bool = False):
+    """An image was uploaded or enabled"""
+    with _lock:
+        if _state["mode"] is None or image_id in _state["live"]:
+            return
+        token = _token(image_id)
+        if _state["mode"] == "random":
+            bag = _state["bag"]
+            bag.insert(random.randint(0, len(bag)), (image_id, token))
+        elif shown:
+            # Back of the rotation: it was shown more recently than anything still waiting
+            _state["cycle"].append((image_id, token))
+        else:
+            _state["fresh"].append((image_id, token))
+
+
+def remove(image_id: int):
+    """An image was disabled or deleted"""
+    with _lock:
+        _state["live"].pop(image_id, None)
+        _compact()
+
@@ -0,0 +1,167 @@
+import os, shutil, hashlib, threading
+from PIL import Image
+from dotenv import load_dotenv
+from utils.image_utils import render_frame, ensure_dirs
+from utils import dither
+
+load_dotenv()
+
+CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "cache/renders")
+CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_MB", "200")) * 1024 * 1024
+
+_lock = threading.Lock()
+_state = {"size": None}  # total bytes on disk, computed lazily
+
+
+def _entry_dir(filename: str) -> str:
+    return os.path.join(CACHE_DIR, filename)
+
+
+def cache_path(filename: str, resolution: str, crop_x: float = 0, crop_y: float = 0,
+               crop_width: float = 100, crop_height: float = 100,
+               preserve_aspect_ratio: bool = False) -> str:
+    """
+    Path of the cached frame for an image rendered with the given crop and resolution.
+    Letterboxed renders ignore the crop, so all crops share one entry.
+    """
+    if preserve_aspect_ratio:
+        crop_x, crop_y, crop_width, crop_height = 0, 0, 100, 100
+    raw = (f"{resolution.strip()}|{float(crop_x):.4f}|{float(crop_y):.4f}|"
+           f"{float(crop_width):.4f}|{float(crop_height):.4f}|{int(bool(preserve_aspect_ratio))}")
+    digest = hashlib.sha1(raw.encode()).hexdigest()[:16]
+    # Lossless, so the display gets exactly the pixels that were rendered
+    return os.path.join(_entry_dir(filename), f"{digest}.png")
+
+
+def panel_cache_path(frame_path: str, dither_mode: str, palette: list[tuple[int, int, int]]) -> str:
+    """Path of the panel-palette version of a cached frame, for one dither mode and palette"""
+    digest = hashlib.sha1(f"{dither_mode}|{palette}".encode()).hexdigest()[:8]
+    return f"{os.path.splitext(frame_path)[0]}.{dither_mode}.{digest}.png"
+
+
+def _scan_size() -> int:
+    total = 0
+    for root, _, files in os.walk(CACHE_DIR):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _evict_locked():
+    """Remove least recently used frames until the cache is under 90% of its budget"""
+    if _state["size"] is None:
+        _state["size"] = _scan_size()
+    if _state["size"] <= CACHE_MAX_BYTES:
+        return
+
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for f in files:
+            p = os.path.join(root, f)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+    entries.sort()
+
+    target = int(CACHE_MAX_BYTES * 0.9)
+    for _, size, p in entries:
+        if _state["size"] <= target:
+            break
+        try:
+            os.remove(p)
+            _state["size"] -= size
+        except OSError:
+            pass
+
+
+def _ensure(src_path: str, resolution: str, crop_x: float, crop_y: float, crop_width: float,
+            crop_height: float, preserve_aspect_ratio: bool) -> tuple[str, bool, Image.Image | None]:
+    """(cache_path, hit, frame) where frame is only set when it was rendered by this call"""
+    filename = os.path.basename(src_path)
+    path = cache_path(filename, resolution, crop_x, crop_y, crop_width, crop_height, preserve_aspect_ratio)
+
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # mtime doubles as the LRU timestamp
+            return path, True, None
+        except OSError:
+            pass  # evicted underneath us, render again
+
+    framed = render_frame(src_path, resolution, crop_x, crop_y, crop_width, crop_height, preserve_aspect_ratio)
+    _store(framed, path)
+    return path, False, framed
+
+
+def _store(image: Image.Image, path: str):
+    ensure_dirs(os.path.dirname(path))
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    # Fast compression: the cache trades some disk for quick writes and reads
+    image.save(tmp_path, "PNG", compress_level=1)
+    os.replace(tmp_path, path)
+
+    with _lock:
+        if _state["size"] is not None:
+            _state["size"] += os.path.getsize(path)
+        _evict_locked()
+
+
+def load_frame(src_path: str, resolution: str, crop_x: float = 0, crop_y: float = 0,
+               crop_width: float = 100, crop_height: float = 100,
+               preserve_aspect_ratio: bool = False) -> tuple[Image.Image, bool]:
+    """
+    Rendered frame for an image as an in-memory RGB image, from the cache when possible.
+    Returns (frame, hit).
+    """
+    path, hit, framed = _ensure(src_path, resolution, crop_x, crop_y, crop_width, crop_height, preserve_aspect_ratio)
+    if framed is not None:
+        return framed, hit
+    try:
+        with Image.open(path) as cached:
+            return cached.convert("RGB"), hit
+    except FileNotFoundError:
+        # Evicted between lookup and read by a concurrent render
+        return render_frame(src_path, resolution, crop_x, crop_y, crop_width, crop_height, preserve_aspect_ratio), False
+
+
+def load_panel_frame(src_path: str, resolution: str, crop_x: float = 0, crop_y: float = 0,
+                     crop_width: float = 100, crop_height: float = 100, preserve_aspect_ratio: bool = False, *,
+                     palette: list[tuple[int, int, int]],
+                     dither_mode: str = dither.DEFAULT_DITHER_MODE) -> tuple[Image.Image, Image.Image, bool]:
+    """
+    Rendered frame plus its dithered panel-palette version, both cached.
+    Returns (frame, panel, hit); hit is True only if neither had to be computed.
+    """
+    frame, hit = load_frame(src_path, resolution, crop_x, crop_y, crop_width, crop_height, preserve_aspect_ratio)
+    filename = os.path.basename(src_path)
+    path = panel_cache_path(cache_path(filename, resolution, crop_x, crop_y, crop_width, crop_height,
+                                       preserve_aspect_ratio), dither_mode, palette)
+    try:
+        with Image.open(path) as cached:
+            panel = cached.copy()
+        os.utime(path)
+        return frame, panel, hit
+    except OSError:
+        pass  # not cached yet (or evicted)
+
+    panel = dither.quantize(frame, palette, dither_mode)
+    _store(panel, path)
+    return frame, panel, False
+
+
+def invalidate(filename: str):
+    """Drop every cached frame for one image (crop edited or image deleted)"""
+    with _lock:
+        shutil.rmtree(_entry_dir(filename), ignore_errors=True)
+        _state["size"] = None
+
+
+def clear():
+    """Drop the whole cache (display resolution or image directory changed)"""
+    with _lock:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        _state["size"] = None
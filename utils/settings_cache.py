@@ -0,0 +1,69 @@
+import threading
+from database import SessionLocal
+from models import Settings
+from utils.log import get_logger
+
+# In-process copy of the single settings row, so request handlers and the background
+# threads don't query SQLite for it every time. Whoever writes the row calls invalidate();
+# components that react to changes register with subscribe().
+#
+# The cached object is a detached copy: read it, never modify or add it to a session.
+# To change settings, load the row with a session, commit, then invalidate().
+
+log = get_logger("settings")
+
+_lock = threading.Lock()
+_state = {"settings": None, "generation": 0}
+_subscribers = []
+
+
+def _snapshot(row: Settings) -> Settings:
+    return Settings(**{c.name: getattr(row, c.name) for c in Settings.__table__.columns})
+
+
+def get(db=None) -> Settings | None:
+    """Current settings; loads them (with `db` if given) only when the cache is cold"""
+    settings = _state["settings"]
+    if settings is not None:
+        return settings
+
+    generation = _state["generation"]
+    if db is None:
+        with SessionLocal() as session:
+            row = session.query(Settings).first()
+            settings = _snapshot(row) if row else None
+    else:
+        row = db.query(Settings).first()
+        settings = _snapshot(row) if row else None
+
+    with _lock:
+        # Don't cache a row read before a concurrent invalidate()
+        if settings is not None and _state["generation"] == generation:
+            _state["settings"] = settings
+    return settings
+
+
+def invalidate():
+    """Drop the cached copy after the settings row was written, and notify subscribers"""
+    with _lock:
+        _state["settings"] = None
+        _state["generation"] += 1
+        callbacks = list(_subscribers)
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            log.exception("Subscriber %s failed: %s", callback.__name__, e)
+
+
+def subscribe(callback):
+    """Call `callback()` (no arguments) whenever the settings change"""
+    with _lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
@@ -0,0 +1,250 @@
+import copy, json, os, threading, time
+from collections import OrderedDict
+from database import SessionLocal
+from models import UploadTask
+from utils import jobs
+from utils.log import get_logger
+
+# Status of upload tasks, bounded in memory and (optionally) mirrored to SQLite.
+#
+# Each task holds the client-facing status dict plus a payload: whatever the upload job needs
+# to pick the task up again after a restart. Finished tasks are kept for UPLOAD_TASK_TTL seconds
+# so clients can still read the outcome, and never more than MAX_TASKS at once; error and
+# duplicate lists are capped per task. Active tasks are never evicted; chunked upload sessions
+# still receiving files are dropped once idle for UPLOAD_SESSION_TTL seconds.
+#
+# With UPLOAD_TASKS_PERSIST on (the default), changes are written to the upload_tasks table
+# behind the callers' backs: changed tasks are marked dirty and a "tasks" job writes them in one
+# transaction, right away for state changes and payload updates, within PERSIST_INTERVAL
+# seconds for plain progress. Callers (async request handlers included) never wait on SQLite.
+# flush() writes whatever is pending at shutdown. load() reads the table back at startup and
+# returns the tasks to resume.
+
+log = get_logger("tasks")
+
+TASK_TTL_SECONDS = int(os.getenv("UPLOAD_TASK_TTL", 3600))
+SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL", 6 * 3600))
+MAX_TASKS = 200
+MAX_MESSAGES = 100         # errors / duplicates kept per task
+PERSIST_INTERVAL = 1.0
+PERSIST = os.getenv("UPLOAD_TASKS_PERSIST", "1").lower() not in ("0", "false", "no")
+
+ACTIVE_STATES = ("queued", "processing")
+RECEIVING = "receiving"  # chunked upload session, files still arriving
+
+# Watchdog threshold for active tasks: no progress at all. There is no limit on the whole task,
+# since a large batch on a slow board can take a long time while still registering files steadily.
+ACTIVITY_TIMEOUT_SECONDS = 120
+
+_lock = threading.Lock()
+_write_lock = threading.Lock()  # one flush at a time, so snapshots reach SQLite in order
+_tasks: "OrderedDict[str, dict]" = OrderedDict()
+_dirty: dict[str, bool] = {}  # task id -> True: write the current snapshot, False: delete the row
+
+
+def _persist(task_id: str, force: bool = False, delete: bool = False):
+    """Mark a task for writing (or deleting) and make sure a flush is coming. Call without holding _lock."""
+    if not PERSIST:
+        return
+    with _lock:
+        _dirty[task_id] = not delete
+    # A flush already waiting picks this change up too
+    jobs.submit("tasks", flush, delay=0.0 if force or delete else PERSIST_INTERVAL, key="task-flush")
+
+
+def flush():
+    """Write pending changes to SQLite in one transaction (runs as a "tasks" job, and at shutdown)"""
+    if not PERSIST:
+        return
+    with _write_lock:
+        with _lock:
+            pending = dict(_dirty)
+            _dirty.clear()
+            rows = [{"id": task_id, "state": rec["status"]["status"],
+                     "status_json": json.dumps(rec["status"]), "payload_json": json.dumps(rec["payload"]),
+                     "created_at": rec["created"], "updated_at": rec["activity"], "finished_at": rec["finished"]}
+                    for task_id, write in pending.items() if write and (rec := _tasks.get(task_id))]
+            deleted = [task_id for task_id, write in pending.items() if not write]
+        if not pending:
+            return
+        try:
+            with SessionLocal() as db:
+                for row in rows:
+                    db.merge(UploadTask(**row))
+                if deleted:
+                    db.query(UploadTask).filter(UploadTask.id.in_(deleted)).delete(synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            log.error("Failed to persist %d tasks: %s", len(pending), e)
+            # Retried with the next change, or at shutdown
+            with _lock:
+                for task_id, write in pending.items():
+                    _dirty.setdefault(task_id, write)
+
+
+def create(task_id: str, status: dict, payload: dict):
+    now = time.time()
+    with _lock:
+        _tasks[task_id] = {"status": copy.deepcopy(status), "payload": copy.deepcopy(payload),
+                           "created": now, "activity": now, "finished": None}
+    _persist(task_id, force=True)
+
+
+def discard(task_id: str):
+    """Forget a task entirely (e.g. it could not be queued)"""
+    with _lock:
+        _tasks.pop(task_id, None)
+    _persist(task_id, delete=True)
+
+
+def get(task_id: str) -> dict | None:
+    """Copy of a task's client-facing status"""
+    with _lock:
+        rec = _tasks.get(task_id)
+        return copy.deepcopy(rec["status"]) if rec else None
+
+
+def payload(task_id: str) -> dict | None:
+    with _lock:
+        rec = _tasks.get(task_id)
+        return copy.deepcopy(rec["payload"]) if rec else None
+
+
+def _apply(rec: dict, fields: dict, now: float) -> bool:
+    """Update a record's status fields and timestamps (caller holds _lock); True on a state change"""
+    state_change = "status" in fields and fields["status"] != rec["status"]["status"]
+    rec["status"].update(fields)
+    rec["activity"] = now
+    if state_change:
+        state = rec["status"]["status"]
+        rec["finished"] = None if state in ACTIVE_STATES or state == RECEIVING else now
+    return state_change
+
+
+def update(task_id: str, **fields):
+    """Change status fields; a change of "status" itself is written at once, progress is throttled"""
+    with _lock:
+        rec = _tasks.get(task_id)
+        if rec is None:
+            return
+        state_change = _apply(rec, fields, time.time())
+    _persist(task_id, force=state_change)
+
+
+def transition(task_id: str, from_state: str, to_state: str) -> bool:
+    """Change the status only if it is still `from_state`; False if another caller got there first"""
+    with _lock:
+        rec = _tasks.get(task_id)
+        if rec is None or rec["status"]["status"] != from_state:
+            return False
+        _apply(rec, {"status": to_state}, time.time())
+    _persist(task_id, force=True)
+    return True
+
+
+def touch(task_id: str):
+    """Record activity without changing the status (keeps the watchdog away)"""
+    with _lock:
+        rec = _tasks.get(task_id)
+        if rec:
+            rec["activity"] = time.time()
+
+
+def append(task_id: str, key: str, message: str):
+    """Add to the "errors" or "duplicates" list, keeping at most MAX_MESSAGES"""
+    with _lock:
+        rec = _tasks.get(task_id)
+        if rec is None:
+            return
+        messages = rec["status"].setdefault(key, [])
+        if len(messages) < MAX_MESSAGES:
+            messages.append(message)
+        else:
+            rec["status"][f"{key}_dropped"] = rec["status"].get(f"{key}_dropped", 0) + 1
+        rec["activity"] = time.time()
+    _persist(task_id, force=True)
+
+
+def set_payload(task_id: str, **fields):
+    """Update the resume payload; always written at once (it records files that moved on disk)"""
+    with _lock:
+        rec = _tasks.get(task_id)
+        if rec is None:
+            return
+        rec["payload"].update(copy.deepcopy(fields))
+        rec["activity"] = time.time()
+    _persist(task_id, force=True)
+
+
+def edit_payload(task_id: str, fn):
+    """Apply fn(payload) under the store lock and persist; for read-modify-write from concurrent requests"""
+    with _lock:
+        rec = _tasks.get(task_id)
+        if rec is None:
+            return None
+        result = fn(rec["payload"])
+        rec["activity"] = time.time()
+    _persist(task_id, force=True)
+    return result
+
+
+def active(states: tuple = ACTIVE_STATES) -> list[str]:
+    with _lock:
+        return [task_id for task_id, rec in _tasks.items() if rec["status"]["status"] in states]
+
+
+def stuck(now: float | None = None) -> list[tuple[str, str]]:
+    """Processing tasks that made no progress for ACTIVITY_TIMEOUT_SECONDS"""
+    now = now or time.time()
+    found = []
+    with _lock:
+        for task_id, rec in _tasks.items():
+            if rec["status"]["status"] != "processing":
+                continue
+            if now - rec["activity"] > ACTIVITY_TIMEOUT_SECONDS:
+                found.append((task_id, f"Upload stuck: No activity for more than {ACTIVITY_TIMEOUT_SECONDS // 60} minutes"))
+    return found
+
+
+def evict(now: float | None = None) -> list[str]:
+    """
+    Drop finished tasks past their TTL, idle upload sessions, then the oldest finished tasks
+    over MAX_TASKS. Returns the dropped ids (their staged files are the caller's to remove).
+    """
+    now = now or time.time()
+    with _lock:
+        finished = [task_id for task_id, rec in _tasks.items() if rec["finished"] is not None]
+        expired = [task_id for task_id in finished if now - _tasks[task_id]["finished"] > TASK_TTL_SECONDS]
+        expired += [task_id for task_id, rec in _tasks.items()
+                    if rec["status"]["status"] == RECEIVING and now - rec["activity"] > SESSION_TTL_SECONDS]
+        remaining = [task_id for task_id in finished if task_id not in expired]
+        overflow = max(0, len(_tasks) - len(expired) - MAX_TASKS)
+        dropped = expired + remaining[:overflow]
+        for task_id in dropped:
+            del _tasks[task_id]
+    for task_id in dropped:
+        _persist(task_id, delete=True)
+    return dropped
+
+
+def load() -> list[str]:
+    """Read persisted tasks back into memory; returns the ids of tasks that were still active"""
+    if not PERSIST:
+        return []
+    with SessionLocal() as db:
+        rows = db.query(UploadTask).order_by(UploadTask.created_at).all()
+    with _lock:
+        for row in rows:
+            _tasks[row.id] = {"status": json.loads(row.status_json or "{}"),
+                              "payload": json.loads(row.payload_json or "{}"),
+                              "created": row.created_at or time.time(),
+                              "activity": row.updated_at or time.time(), "finished": row.finished_at}
+    evict()
+    return active()
+
+
+def stats() -> dict:
+    with _lock:
+        return {"tasks": len(_tasks), "active": sum(rec["status"]["status"] in ACTIVE_STATES for rec in _tasks.values()),
+                "receiving": sum(rec["status"]["status"] == RECEIVING for rec in _tasks.values()),
+                "limit": MAX_TASKS, "ttl_seconds": TASK_TTL_SECONDS, "persist": PERSIST}